@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# Optional cross-process tier: a local SQLite file every worker on the host
+# can read and write. Connections are opened per process and thread since
+# sqlite3 connections must not cross either boundary.
+class SharedStore:
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS answers ("
+                     "version TEXT, key TEXT, value TEXT, expires REAL, "
+                     "PRIMARY KEY (version, key))")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, version, key, now):
+        row = self._conn().execute(
+            "SELECT value FROM answers WHERE version = ? AND key = ? AND expires > ?",
+            (version, key, now)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, version, key, value, expires):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                     (version, key, json.dumps(value), expires))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune(version, time.time())
+        conn.commit()
+
+    # Drop expired rows, rows from older index versions and anything past maxsize.
+    # Best effort: if another process holds the write lock, the next prune
+    # catches up, and callers (reload hooks included) never see the error.
+    def prune(self, version, now):
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM answers WHERE version != ? OR expires <= ?", (version, now))
+            conn.execute("DELETE FROM answers WHERE rowid NOT IN "
+                         "(SELECT rowid FROM answers ORDER BY expires DESC LIMIT ?)", (self.maxsize,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Answer cache store not pruned: {e}")
+
+
+# LRU + TTL cache of final answers keyed on (index version, processed query).
+# Answers are deterministic for a given index, so changing the version
+# invalidates everything cached for the previous one.
+class AnswerCache:
+    def __init__(self, maxsize=1024, ttl=3600, store_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = SharedStore(store_path, maxsize * 16) if store_path else None
+
+    def set_version(self, version):
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._entries.clear()
+        if self._store:
+            self._store.prune(version, time.time())
+
+    def get(self, version, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key) if version == self.version else None
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        value = None
+        if self._store:
+            try:
+                value = self._store.get(version, key, now)
+            except sqlite3.Error as e:
+                print(f"Answer cache store unavailable: {e}")
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if version == self.version:
+                    self._insert(key, value, now + self.ttl)
+        return value
+
+    # Results computed against an index that has since been replaced are dropped
+    def put(self, version, key, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            if version != self.version:
+                return
+            self._insert(key, value, expires)
+        if self._store:
+            try:
+                self._store.put(version, key, value, expires)
+            except sqlite3.Error as e:
+                print(f"Answer cache store unavailable: {e}")
+
+    def _insert(self, key, value, expires):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'currsize': len(self._entries),
+                    'maxsize': self.maxsize, 'ttl': self.ttl, 'version': self.version}
@@ -0,0 +1,105 @@
+# ASGI entry point: a lean async JSON API next to the Dash UI, sharing the
+# index loaded by chatbot.py.
+#
+#   uvicorn asgi:app --workers 4
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+#
+# Requests are parsed on the event loop and the CPU-bound preprocessing and
+# search run on a thread pool, so slow clients never hold up inference. When
+# a2wsgi is installed, every other path is handed to the Flask server, so the
+# Dash UI is served by the same process.
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import chatbot
+
+ANSWER_THREADS = int(os.environ.get('CHATBOT_ANSWER_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+MAX_BODY_SIZE = int(os.environ.get('CHATBOT_MAX_BODY', str(1 << 20)))
+
+executor = ThreadPoolExecutor(max_workers=ANSWER_THREADS, thread_name_prefix='answer')
+
+try:
+    from a2wsgi import WSGIMiddleware
+    dash_app = WSGIMiddleware(chatbot.server)
+except ImportError:
+    dash_app = None
+
+
+def answer_question(question):
+    return chatbot.answer_batch([question])[0]
+
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# POST /api/answer {"question": "..."} -> {"question", "answer", "score", "fallback", "matches"}
+async def answer_endpoint(scope, receive, send):
+    if scope['method'] != 'POST':
+        return await send_json(send, 405, {'error': "Use POST"})
+    try:
+        body = await read_body(receive)
+    except ValueError as e:
+        return await send_json(send, 413, {'error': str(e)})
+    if body is None:
+        return
+    try:
+        question = json.loads(body).get('question')
+    except (ValueError, AttributeError):
+        question = None
+    if not isinstance(question, str):
+        return await send_json(send, 400, {'error': "Body must be JSON with a 'question' string"})
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(executor, answer_question, question)
+    except Exception as e:
+        print(f"Error processing question: {e}")
+        return await send_json(send, 500, {'error': "Could not answer the question"})
+    await send_json(send, 200, result)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Each server worker process runs its own watcher and profiler
+            chatbot.start_watcher()
+            chatbot.start_profiler()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['path'] == '/api/answer':
+        return await answer_endpoint(scope, receive, send)
+    if dash_app is not None:
+        return await dash_app(scope, receive, send)
+    if scope['type'] == 'http':
+        await send_json(send, 404, {'error': "Not found"})
@@ -0,0 +1,518 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neighbors import NearestNeighbors
+
+from dense_index import HNSWIndex, IVFIndex, LSAIndex, LSAProjection, top_k_rows
+from fuzzy_index import NGRAM_RANGE, CharNgramIndex, fuse
+from index_store import index_from_processed, load_dataset, load_or_build_index
+from nlp_resources import check_resources
+from preprocessing import (build_lemma_table, clear_caches, fast_preprocess, lemmatize, nltk_preprocess,
+                           preprocess_batch, preprocess_corpus, set_lemma_table)
+from retrieval import CosineTopK
+
+
+# Median per-call latency in microseconds of fn over texts
+def time_per_call(fn, texts, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        runs.append((time.perf_counter() - start) / len(texts) * 1e6)
+    return sorted(runs)[len(runs) // 2]
+
+
+# Inputs the fast tokenizer must split exactly as NLTK's Treebank tokenizer
+PARITY_CASES = [
+    "i can't go to the store today",
+    "what's your name?",
+    "don't stop, cannot stop!",
+    "hello, world... how are you?",
+    '"quoted" text',
+    "gonna go, wanna come?",
+    "it costs $5.00 (plus tax)",
+    "e-mail me at a@b.com; thanks",
+    "the dogs' toys were running",
+]
+# Known Treebank differences, with the fast output pinned. Each one must still
+# give the same TfidfVectorizer tokens as NLTK's output
+KNOWN_DIFFERENCES = {
+    'u.s.a.': 'u.s.a .',
+    "rock 'n' roll": "rock ' n ' roll",
+    'a/b': 'a / b',
+}
+
+
+# The fixed cases above; returns a list of failure messages
+def check_parity_cases(analyzer):
+    failures = []
+    for text in PARITY_CASES:
+        reference, fast = nltk_preprocess(text), fast_preprocess(text)
+        if reference != fast:
+            failures.append(f"PARITY {text!r}\n  nltk: {reference!r}\n  fast: {fast!r}")
+    for text, pinned in KNOWN_DIFFERENCES.items():
+        reference, fast = nltk_preprocess(text), fast_preprocess(text)
+        if fast != pinned or analyzer(reference) != analyzer(fast):
+            failures.append(f"KNOWN {text!r}\n  nltk: {reference!r}\n  fast: {fast!r}\n  pinned: {pinned!r}")
+    return failures
+
+
+# Compare the fast preprocessor against the NLTK one on the fixed cases and
+# every dataset question. "exact" means identical output strings; "vector"
+# means identical tokens as seen by TfidfVectorizer, which is what retrieval
+# actually depends on. Fails on any fixed case or any vector mismatch.
+def bench_preprocess(args):
+    check_resources()
+    texts = [q.lower().strip() for q in load_dataset(args.dataset)['Question']]
+    cases = PARITY_CASES + list(KNOWN_DIFFERENCES)
+    set_lemma_table(build_lemma_table(texts + cases))
+    analyzer = TfidfVectorizer().build_analyzer()
+    failures = check_parity_cases(analyzer)
+
+    exact = vector = 0
+    mismatches = []
+    for text in texts:
+        reference, fast = nltk_preprocess(text), fast_preprocess(text)
+        exact += reference == fast
+        if analyzer(reference) == analyzer(fast):
+            vector += 1
+        else:
+            mismatches.append((text, reference, fast))
+
+    # Warm the per-token lemma cache so both engines are measured on tokenization
+    # and lookup cost rather than first-touch WordNet access
+    for text in texts:
+        nltk_preprocess(text)
+    nltk_us = time_per_call(nltk_preprocess, texts, args.repeat)
+    fast_us = time_per_call(fast_preprocess, texts, args.repeat)
+
+    print(f"texts:          {len(texts)}")
+    print(f"exact parity:   {exact / len(texts):.2%}")
+    print(f"vector parity:  {vector / len(texts):.2%}")
+    print(f"nltk:           {nltk_us:.1f} us/text")
+    print(f"fast:           {fast_us:.1f} us/text ({nltk_us / fast_us:.1f}x)")
+    print(f"lemma cache:     {lemmatize.cache_info()}")
+    print(f"fixed cases:    {len(cases) - len(failures)}/{len(cases)} pass")
+    for text, reference, fast in mismatches[:10]:
+        print(f"MISMATCH {text!r}\n  nltk: {reference!r}\n  fast: {fast!r}")
+    for failure in failures:
+        print(failure)
+    return 1 if mismatches or failures else 0
+
+
+# Drop, swap, replace or insert one letter in about a third of the words
+def add_typos(text, rng):
+    words = text.split()
+    for j, word in enumerate(words):
+        if len(word) < 3 or rng.random() > 0.34:
+            continue
+        pos = rng.randrange(len(word) - 1)
+        edit = rng.choice(('drop', 'swap', 'replace', 'insert'))
+        if edit == 'drop':
+            word = word[:pos] + word[pos + 1:]
+        elif edit == 'swap':
+            word = word[:pos] + word[pos + 1] + word[pos] + word[pos + 2:]
+        elif edit == 'replace':
+            word = word[:pos] + rng.choice(string.ascii_lowercase) + word[pos + 1:]
+        else:
+            word = word[:pos] + rng.choice(string.ascii_lowercase) + word[pos:]
+        words[j] = word
+    return ' '.join(words)
+
+
+def csr_nbytes(X):
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+# Word index vs character n-gram index vs their fusion on dataset questions
+# with injected typos. A hit is a top match whose answer is the one the
+# original question maps to.
+def bench_fuzzy(args):
+    check_resources()
+    df = load_dataset(args.dataset)
+    processed, lemmas = preprocess_corpus(df['Question'], workers=1)
+    set_lemma_table(lemmas)
+    index = index_from_processed(df['Question'], df['Answer'], processed, lemmas, 'bench')
+    word = CosineTopK(index.X, index.XT)
+    fuzzy = CharNgramIndex.build(index.processed, NGRAM_RANGE)
+    answers = list(index.answers)
+
+    rng = random.Random(args.seed)
+    queries = preprocess_batch([add_typos(q.lower(), rng) for q in df['Question']])
+
+    # Each returns (scores, indices) for a single question
+    def word_top(text):
+        scores, idx = word.search(index.vectorizer.transform([text]), args.k)
+        return scores[0], idx[0]
+
+    def fuzzy_top(text):
+        scores, idx = fuzzy.search_text([text], args.k)
+        return scores[0], idx[0]
+
+    def fused_top(text):
+        return fuse(word_top(text), fuzzy_top(text), args.weight, args.k)
+
+    print(f"questions:      {len(queries)}")
+    print(f"n-grams:        {NGRAM_RANGE}, fusion weight {args.weight}")
+    print(f"word index:     {csr_nbytes(index.X) + csr_nbytes(index.XT)} bytes")
+    print(f"n-gram index:   {csr_nbytes(fuzzy.engine.X) + csr_nbytes(fuzzy.engine.XT)} bytes")
+    for name, fn in (('word', word_top), ('n-gram', fuzzy_top), ('fused', fused_top)):
+        hits = 0
+        for i, text in enumerate(queries):
+            scores, idx = fn(text)
+            hits += bool(len(idx)) and scores[0] > 0 and answers[idx[0]] == answers[i]
+        us = time_per_call(fn, queries, args.repeat)
+        print(f"{name + ':':<15} top-1 {hits / len(queries):.1%}, {us:.1f} us/query")
+    return 0
+
+
+# Synthetic FAQ questions: each belongs to one of n_topics topics and mixes
+# Zipf-distributed topic words with common filler words, so that related
+# questions share vocabulary the way real FAQ clusters do
+def synthetic_questions(n, seed=0, n_topics=None, vocab_size=None):
+    rng = np.random.default_rng(seed)
+    n_topics = n_topics or max(4, int(np.sqrt(n)))
+    vocab_size = vocab_size or max(500, min(200000, n * 2))
+    vocab = np.array([f"w{i}" for i in range(vocab_size)])
+    fillers = ['what', 'how', 'is', 'the', 'do', 'i', 'can', 'my', 'to', 'a', 'for', 'you']
+    topic_words = rng.integers(0, vocab_size, size=(n_topics, 50))
+    zipf = 1 / np.arange(1, 51)
+    zipf /= zipf.sum()
+    questions = []
+    for topic in rng.integers(0, n_topics, size=n):
+        words = list(vocab[topic_words[topic, rng.choice(50, size=rng.integers(3, 9), p=zipf)]])
+        words += list(rng.choice(fillers, size=rng.integers(1, 4)))
+        rng.shuffle(words)
+        questions.append(' '.join(words))
+    return questions
+
+
+# Queries drawn from corpus questions with about a third of their words
+# dropped or replaced by random vocabulary
+def perturbed_queries(questions, n, seed=1):
+    rng = np.random.default_rng(seed)
+    vocab = sorted({w for q in questions[:1000] for w in q.split()})
+    queries = []
+    for i in rng.integers(0, len(questions), size=n):
+        words = [w if rng.random() > 0.33 else rng.choice(vocab) for w in questions[i].split()
+                 if rng.random() > 0.15]
+        queries.append(' '.join(words) or questions[i])
+    return queries
+
+
+def time_search(fn, Q, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(Q)
+        runs.append((time.perf_counter() - start) / Q.shape[0] * 1e6)
+    return sorted(runs)[len(runs) // 2], result
+
+
+# Synthetic corpora have many near-tied neighbors, so a result counts as a
+# hit when its exact score reaches the exact k-th best score
+def recall(EQ, E, found, kth_scores):
+    exact = np.einsum('qd,qkd->qk', EQ, E[np.maximum(found, 0)])
+    return np.mean((found >= 0) & (exact >= kth_scores[:, None] - 1e-5))
+
+
+# Recall and latency of the ANN backends against exact search. Recall@k is
+# measured against exact cosine search in the same LSA space, and top-1
+# agreement against TF-IDF brute force, which is what the app used to run.
+def bench_ann(args):
+    questions = synthetic_questions(args.rows, args.seed)
+    queries = perturbed_queries(questions, args.queries, args.seed + 1)
+    tfidf = TfidfVectorizer()
+    X = tfidf.fit_transform(questions).tocsr()
+    Q = tfidf.transform(queries)
+
+    start = time.perf_counter()
+    projection = LSAProjection.fit(X, args.rank)
+    E = projection.embeddings
+    print(f"corpus:         {X.shape[0]} rows, {X.shape[1]} terms, {len(queries)} queries")
+    print(f"lsa:            rank {projection.rank}, fitted in {time.perf_counter() - start:.1f}s, "
+          f"{E.nbytes} bytes as float32")
+
+    brute = NearestNeighbors(n_neighbors=args.k, algorithm='brute').fit(X)
+    us, (_, baseline) = time_search(lambda Q: brute.kneighbors(Q), Q, args.repeat)
+    print(f"{'sklearn brute:':<22} {us:8.1f} us/query")
+    us, (exact_scores, exact) = time_search(lambda Q: top_k_rows(projection.transform(Q) @ E.T, args.k),
+                                            Q, args.repeat)
+    EQ = projection.transform(Q)
+    print(f"{'lsa exact:':<22} {us:8.1f} us/query, top-1 vs tf-idf "
+          f"{np.mean(exact[:, 0] == baseline[:, 0]):.1%}")
+
+    engines = []
+    for n_probe in args.probes:
+        engines.append((f"ivf probe={n_probe}", lambda n_probe=n_probe: IVFIndex(X, projection=projection,
+                                                                              n_probe=n_probe)))
+    engines.append(('hnsw', lambda: HNSWIndex(X, projection=projection)))
+    for name, make in engines:
+        try:
+            start = time.perf_counter()
+            engine = make()
+            build_s = time.perf_counter() - start
+        except ImportError as e:
+            print(f"{name + ':':<22} skipped ({e})")
+            continue
+        us, (_, found) = time_search(lambda Q: engine.search_dense(projection.transform(Q), args.k),
+                                     Q, args.repeat)
+        print(f"{name + ':':<22} {us:8.1f} us/query, recall@{args.k} {recall(EQ, E, found, exact_scores[:, -1]):.3f}, "
+              f"built in {build_s:.1f}s")
+    return 0
+
+
+# Memory, latency and quality of exact LSA search at several ranks against
+# sparse TF-IDF search. Quality is the TF-IDF cosine of the LSA top-1 as a
+# share of the best TF-IDF cosine, averaged over queries, plus how often the
+# top-1 is the same document.
+def bench_lsa(args):
+    questions = synthetic_questions(args.rows, args.seed)
+    queries = perturbed_queries(questions, args.queries, args.seed + 1)
+    tfidf = TfidfVectorizer()
+    X = tfidf.fit_transform(questions).tocsr()
+    Q = tfidf.transform(queries)
+    sparse_engine = CosineTopK(X)
+    us, (best, exact) = time_search(lambda Q: sparse_engine.search(Q, 1), Q, args.repeat)
+    print(f"corpus:         {X.shape[0]} rows, {X.shape[1]} terms, {len(queries)} queries")
+    print(f"{'tf-idf:':<12} {csr_nbytes(X) + csr_nbytes(sparse_engine.XT):>12} bytes {us:8.1f} us/query")
+
+    for rank in args.ranks:
+        start = time.perf_counter()
+        engine = LSAIndex(X, projection=LSAProjection.fit(X, rank))
+        fit_s = time.perf_counter() - start
+        nbytes = engine.E.nbytes + engine.projection.components_t.nbytes
+        us, (_, found) = time_search(lambda Q: engine.search(Q, 1), Q, args.repeat)
+        found_scores = np.asarray(Q.multiply(X[found[:, 0]]).sum(axis=1)).ravel()
+        valid = best[:, 0] > 0
+        retained = np.mean(found_scores[valid] / best[valid, 0])
+        print(f"{f'lsa {engine.projection.rank}:':<12} {nbytes:>12} bytes {us:8.1f} us/query, "
+              f"score retained {retained:.1%}, same top-1 {np.mean(found[:, 0] == exact[:, 0]):.1%}, "
+              f"fitted in {fit_s:.1f}s")
+    return 0
+
+
+def percentiles(samples_us):
+    samples = np.asarray(samples_us)
+    return {'p50': float(np.percentile(samples, 50)), 'p90': float(np.percentile(samples, 90)),
+            'p99': float(np.percentile(samples, 99)), 'mean': float(samples.mean())}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stage_latencies(fn, inputs):
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+
+# Runs in a fresh process per corpus size so that peak RSS belongs to that
+# size alone. The heavy dependencies are imported before the baseline and the
+# build is timed on load_or_build_index alone, so build figures are not import
+# overhead; importing chatbot afterwards maps the artifact just built. The
+# answer cache is disabled and the preprocessing caches cleared so every stage
+# does its full work.
+def measure_pipeline(size, args, workdir):
+    dataset = os.path.join(workdir, f"faq-{size}.csv")
+    questions = synthetic_questions(size, args.seed)
+    pd.DataFrame({'Question': questions, 'Answer': [f"answer {i}" for i in range(size)]}).to_csv(dataset, index=False)
+    queries = perturbed_queries(questions, args.queries, args.seed + 1)
+    del questions
+    os.environ.update({'CHATBOT_DATASET': dataset, 'CHATBOT_INDEX_DIR': os.path.join(workdir, f"index-{size}"),
+                       'CHATBOT_ANSWER_CACHE_SIZE': '0'})
+    # Everything chatbot imports, so the baseline already holds it
+    import dash  # noqa: F401
+    import dash_bootstrap_components  # noqa: F401
+    import flask  # noqa: F401
+    import answer_cache  # noqa: F401
+    import live_index  # noqa: F401
+    import metrics  # noqa: F401
+    import profiler  # noqa: F401
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    load_or_build_index(os.environ['CHATBOT_DATASET'], os.environ['CHATBOT_INDEX_DIR'])
+    build_s = time.perf_counter() - start
+    build_peak = peak_rss_mb()
+    import chatbot
+
+    # The memo tables were sized when this module imported preprocessing, so
+    # clear them before each stage that preprocesses
+    snapshot = chatbot.live.current
+    clear_caches()
+    stages = {'preprocess_text': stage_latencies(chatbot.preprocess_text, queries)}
+    processed = [chatbot.preprocess_text(q) for q in queries]
+    vectors = [snapshot.transform([p]) for p in processed]
+    stages['transform'] = stage_latencies(lambda p: snapshot.transform([p]), processed)
+    stages['search'] = stage_latencies(lambda Q: snapshot.search(Q, chatbot.TOP_K), vectors)
+    clear_caches()
+    stages['get_answer'] = stage_latencies(lambda q: chatbot.get_answer(1, q), queries)
+
+    clear_caches()
+    start = time.perf_counter()
+    for i in range(0, len(queries), args.batch):
+        chatbot.answer_batch(queries[i:i + args.batch])
+    batch_qps = len(queries) / (time.perf_counter() - start)
+
+    return {
+        'rows': size,
+        'build_s': build_s,
+        'build_peak_mb': build_peak - rss_before,
+        'query_peak_mb': peak_rss_mb() - rss_before,
+        'stages_us': stages,
+        'throughput_qps': {'single': 1e6 / stages['get_answer']['mean'], f'batch{args.batch}': batch_qps},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metrics compared against a baseline run; all are lower-is-better
+def regression_metrics(result):
+    metrics = {'build_s': result['build_s'], 'build_peak_mb': result['build_peak_mb'],
+               'query_peak_mb': result['query_peak_mb']}
+    for stage, stats in result['stages_us'].items():
+        metrics[f'{stage}.p50'] = stats['p50']
+        metrics[f'{stage}.p99'] = stats['p99']
+    return metrics
+
+
+def compare_results(current, baseline, threshold, min_delta):
+    regressions = []
+    old_by_rows = {r['rows']: r for r in baseline['results']}
+    for result in current['results']:
+        old = old_by_rows.get(result['rows'])
+        if old is None:
+            continue
+        old_metrics = regression_metrics(old)
+        for name, value in regression_metrics(result).items():
+            before = old_metrics.get(name)
+            # Ignore tiny absolute differences, which are mostly noise
+            if before and value > before * (1 + threshold) and value - before > min_delta:
+                regressions.append((result['rows'], name, before, value))
+    return regressions
+
+
+# End-to-end pipeline benchmark on synthetic corpora: index build time and
+# peak memory, per-stage latency percentiles and throughput for each size.
+# Results go to JSON; with --baseline, exits non-zero on regressions.
+def bench_pipeline(args):
+    check_resources()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='chatbot-bench-') as workdir:
+        ctx = multiprocessing.get_context('spawn')
+        for size in args.sizes:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(measure_pipeline, (size, args, workdir))
+            results.append(result)
+            stages = '  '.join(f"{name} p50 {stats['p50']:.0f}us p99 {stats['p99']:.0f}us"
+                               for name, stats in result['stages_us'].items())
+            print(f"{size:>8} rows: build {result['build_s']:.1f}s, peak {result['build_peak_mb']:.0f} MB, "
+                  f"query peak {result['query_peak_mb']:.0f} MB, "
+                  f"{result['throughput_qps'][f'batch{args.batch}']:.0f} q/s batched")
+            print(f"          {stages}")
+
+    report = {
+        'meta': {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'machine': platform.machine(),
+                 'preprocessor': os.environ.get('CHATBOT_PREPROCESSOR', 'nltk'),
+                 'retrieval': os.environ.get('CHATBOT_RETRIEVAL', 'cosine'),
+                 'queries': args.queries, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.threshold, args.min_delta)
+        for rows, name, before, value in regressions:
+            print(f"REGRESSION {rows} rows {name}: {before:.1f} -> {value:.1f} (+{value / before - 1:.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions over {args.threshold:.0%} against {baseline['meta'].get('commit')}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot pipeline benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pre = sub.add_parser('preprocess', help="parity check and timing of the fast preprocessor")
+    pre.add_argument('--dataset', default='chatbot_dataset.csv')
+    pre.add_argument('--repeat', type=int, default=5)
+    fz = sub.add_parser('fuzzy', help="accuracy and latency of the n-gram index on misspelled questions")
+    fz.add_argument('--dataset', default='chatbot_dataset.csv')
+    fz.add_argument('--repeat', type=int, default=5)
+    fz.add_argument('--k', type=int, default=3)
+    fz.add_argument('--weight', type=float, default=0.3)
+    fz.add_argument('--seed', type=int, default=0)
+    ann = sub.add_parser('ann', help="recall and latency of the ANN backends on a synthetic corpus")
+    ann.add_argument('--rows', type=int, default=20000)
+    ann.add_argument('--queries', type=int, default=500)
+    ann.add_argument('--rank', type=int, default=128)
+    ann.add_argument('--k', type=int, default=10)
+    ann.add_argument('--probes', type=int, nargs='+', default=[1, 4, 8, 16])
+    ann.add_argument('--repeat', type=int, default=3)
+    ann.add_argument('--seed', type=int, default=0)
+    lsa = sub.add_parser('lsa', help="memory, latency and quality of exact LSA search by rank")
+    lsa.add_argument('--rows', type=int, default=20000)
+    lsa.add_argument('--queries', type=int, default=500)
+    lsa.add_argument('--ranks', type=int, nargs='+', default=[32, 64, 128, 256])
+    lsa.add_argument('--repeat', type=int, default=3)
+    lsa.add_argument('--seed', type=int, default=0)
+    pipe = sub.add_parser('pipeline', help="per-stage latency, throughput and memory on synthetic corpora")
+    pipe.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                      help="corpus sizes in rows, e.g. 1000 10000 100000 1000000")
+    pipe.add_argument('--queries', type=int, default=1000)
+    pipe.add_argument('--batch', type=int, default=100)
+    pipe.add_argument('--seed', type=int, default=0)
+    pipe.add_argument('--output', help="write results to this JSON file")
+    pipe.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    pipe.add_argument('--threshold', type=float, default=0.2,
+                      help="relative slowdown or memory growth that counts as a regression")
+    pipe.add_argument('--min-delta', type=float, default=5.0,
+                      help="ignore absolute differences below this (us, MB or s)")
+    args = parser.parse_args()
+
+    if args.command == 'preprocess':
+        sys.exit(bench_preprocess(args))
+    elif args.command == 'fuzzy':
+        sys.exit(bench_fuzzy(args))
+    elif args.command == 'ann':
+        sys.exit(bench_ann(args))
+    elif args.command == 'lsa':
+        sys.exit(bench_lsa(args))
+    elif args.command == 'pipeline':
+        sys.exit(bench_pipeline(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,168 @@
+import hashlib
+import hmac
+import os
+import time
+
+import numpy as np
 import pandas as pd
-import nltk
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.neighbors import NearestNeighbors
+from flask import Response, g, jsonify, request, send_file
 import dash
 from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
 
-# Download NLTK data
-nltk.download('punkt')
-nltk.download('wordnet')
-
-# Initialize lemmatizer
-lemmatizer = WordNetLemmatizer()
-
-# Preprocessing function with error handling
-def preprocess_text(text):
-    try:
-        if pd.isna(text):
-            return ""
-        tokens = word_tokenize(str(text).lower())
-        lemmatized = [lemmatizer.lemmatize(token) for token in tokens]
-        return ' '.join(lemmatized)
-    except:
-        return ""
-
-# Load dataset from CSV
+from answer_cache import AnswerCache
+from dense_index import HNSW_EF, HNSW_M, IVF_LISTS, IVF_PROBE, LSA_RANK, load_or_build_lsa
+from fuzzy_index import NGRAM_RANGE, fuse, load_or_build_fuzzy_index
+from index_store import build_index, load_or_build_index
+from live_index import LiveIndex, Snapshot
+import metrics
+from metrics import span
+from nlp_resources import NLPResourceError
+from profiler import PROFILE_MAX_SECONDS, current_profile, start_profile
+from preprocessing import PREPROCESSOR, cache_stats, preprocess_batch, preprocess_text, set_lemma_table
+from retrieval import build_engine, is_dense
+
+DATASET_PATH = os.environ.get('CHATBOT_DATASET', 'chatbot_dataset.csv')  # Replace with your CSV filename
+INDEX_DIR = os.environ.get('CHATBOT_INDEX_DIR', 'index')
+# 'cosine' scores every matching document, 'inverted' prunes with MaxScore,
+# 'lsa' searches dense LSA embeddings exactly, 'ivf' and 'hnsw' approximately
+RETRIEVAL_MODE = os.environ.get('CHATBOT_RETRIEVAL', 'cosine')
+MAX_BATCH_SIZE = int(os.environ.get('CHATBOT_MAX_BATCH', '10000'))
+ANSWER_CACHE_SIZE = int(os.environ.get('CHATBOT_ANSWER_CACHE_SIZE', '1024'))
+ANSWER_CACHE_TTL = float(os.environ.get('CHATBOT_ANSWER_CACHE_TTL', '3600'))
+# Optional SQLite file shared by all workers on the host
+ANSWER_CACHE_DB = os.environ.get('CHATBOT_ANSWER_CACHE_DB')
+# Seconds between dataset change checks; 0 disables hot reload
+WATCH_INTERVAL = float(os.environ.get('CHATBOT_WATCH_INTERVAL', '0'))
+# Number of ranked matches returned per question
+TOP_K = int(os.environ.get('CHATBOT_TOP_K', '3'))
+# Best matches with a lower cosine similarity get the fallback answer instead
+MIN_SIMILARITY = float(os.environ.get('CHATBOT_MIN_SIMILARITY', '0.1'))
+FALLBACK_ANSWER = os.environ.get(
+    'CHATBOT_FALLBACK_ANSWER',
+    "Sorry, I don't have an answer for that yet. Could you try rephrasing the question?")
+# Character n-gram index for misspelled questions: 'off', 'fallback' (used
+# when the word index finds nothing good enough) or 'fuse' (scores blended
+# with the word index, CHATBOT_FUZZY_WEIGHT going to the n-gram side)
+FUZZY_MODE = os.environ.get('CHATBOT_FUZZY', 'off')
+FUZZY_WEIGHT = float(os.environ.get('CHATBOT_FUZZY_WEIGHT', '0.3'))
+# N-gram cosine runs higher than word cosine, so fallback matches need more
+FUZZY_MIN_SIMILARITY = float(os.environ.get('CHATBOT_FUZZY_MIN_SIMILARITY', '0.3'))
+# Profile each process for this many seconds after it starts; 0 disables
+PROFILE_SECONDS = float(os.environ.get('CHATBOT_PROFILE', '0'))
+# Enables the /admin endpoints when set; requests must send it as X-Admin-Token
+ADMIN_TOKEN = os.environ.get('CHATBOT_ADMIN_TOKEN')
+if FUZZY_MODE not in ('off', 'fallback', 'fuse'):
+    raise ValueError(f"Unknown fuzzy mode '{FUZZY_MODE}', expected off, fallback or fuse")
+
+# Load the prebuilt index for this dataset, building it on first run
 try:
-    df = pd.read_csv('chatbot_dataset.csv')  # Replace with your CSV filename
-    # Clean data - ensure required columns exist
-    if 'Question' not in df.columns or 'Answer' not in df.columns:
-        raise ValueError("CSV must contain 'Question' and 'Answer' columns")
-    df = df.dropna(subset=['Question', 'Answer'])
-    df['Question'] = df['Question'].astype(str)
-    df['Answer'] = df['Answer'].astype(str)
-    df['Processed'] = df['Question'].apply(preprocess_text)
+    index = load_or_build_index(DATASET_PATH, INDEX_DIR)
+except NLPResourceError:
+    raise
 except Exception as e:
     print(f"Error loading dataset: {e}")
     # Fallback to sample data if CSV fails
-    df = pd.DataFrame({
+    index = build_index(pd.DataFrame({
         'Question': ["What is your return policy?", "How do I contact support?"],
         'Answer': ["30 days money back guarantee", "Email us at support@company.com"]
-    })
-    df['Processed'] = df['Question'].apply(preprocess_text)
+    }), version='sample')
+
+# Every setting that changes the cached result dicts. Hashed into the
+# snapshot version, so processes sharing the answer cache file (or a restart
+# with new settings) never serve results computed under other settings.
+RESULT_SETTINGS = hashlib.sha256(repr((
+    PREPROCESSOR, RETRIEVAL_MODE, LSA_RANK, IVF_LISTS, IVF_PROBE, HNSW_M, HNSW_EF, TOP_K,
+    MIN_SIMILARITY, FALLBACK_ANSWER, FUZZY_MODE, NGRAM_RANGE, FUZZY_WEIGHT, FUZZY_MIN_SIMILARITY,
+)).encode()).hexdigest()[:16]
 
 # Create model
-vectorizer = TfidfVectorizer()
-X = vectorizer.fit_transform(df['Processed'])
-model = NearestNeighbors(n_neighbors=1, algorithm='brute')
-model.fit(X)
+def make_snapshot(index):
+    projection = load_or_build_lsa(index, INDEX_DIR) if is_dense(RETRIEVAL_MODE) else None
+    model = build_engine(RETRIEVAL_MODE, index.X, index.XT, projection)
+    fuzzy = load_or_build_fuzzy_index(index, INDEX_DIR) if FUZZY_MODE != 'off' else None
+    return Snapshot(index, model, f"{index.version}:{PREPROCESSOR}:{RETRIEVAL_MODE}:{RESULT_SETTINGS}",
+                    fallback=fuzzy)
+
+# Runs after a reload has been published
+def on_swap(snapshot):
+    set_lemma_table(snapshot.index.lemmas)
+    answer_cache.set_version(snapshot.version)
+
+# Final answers are deterministic per model version, so cache them end to end
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_DB)
+live = LiveIndex(DATASET_PATH, INDEX_DIR, index, make_snapshot, on_swap)
+on_swap(live.current)
+
+# Hot reload: rebuild in the background when the dataset changes. Threads do
+# not survive fork, so under gunicorn this is started in post_fork instead.
+def start_watcher():
+    if WATCH_INTERVAL > 0:
+        live.start_watcher(WATCH_INTERVAL)
+
+# Startup profile window, started per process like the watcher
+def start_profiler():
+    if PROFILE_SECONDS > 0:
+        start_profile(PROFILE_SECONDS)
+
+# Turn one row of top-k search output into an answer, falling back when even
+# the best match is not similar enough
+def make_result(snapshot, scores, indices, min_similarity=MIN_SIMILARITY):
+    keep = scores > 0
+    answers = snapshot.answers_for(indices[keep])
+    matches = [{'answer': answer, 'score': float(score)} for answer, score in zip(answers, scores[keep])]
+    best = matches[0]['score'] if matches else 0.0
+    if best < min_similarity or not matches:
+        return {'answer': FALLBACK_ANSWER, 'score': best, 'fallback': True, 'matches': matches}
+    return {'answer': matches[0]['answer'], 'score': best, 'fallback': False, 'matches': matches}
+
+NO_MATCH = (np.zeros(0), np.zeros(0, dtype=np.int64))
+
+# Answer already-preprocessed, non-empty questions, consulting the cache first
+# and running one transform and top-k search for all the misses together
+def lookup_answers(processed):
+    snapshot = live.current
+    with span('cache'):
+        results = [answer_cache.get(snapshot.version, p) for p in processed]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        with span('transform'):
+            query_vecs = snapshot.transform([processed[i] for i in missing])
+        depth = TOP_K * 4 if FUZZY_MODE == 'fuse' else TOP_K
+        # Questions with no in-vocabulary terms cannot match anything in the
+        # word index, so only the others are scored there
+        nonempty = query_vecs.getnnz(axis=1) > 0
+        found = {}
+        scored = np.flatnonzero(nonempty)
+        if len(scored):
+            with span('search'):
+                scores, idx = snapshot.search(query_vecs[scored], depth)
+            found.update((row, (scores[n], idx[n])) for n, row in enumerate(scored))
+
+        # The n-gram index sees every question when fusing, otherwise only the
+        # ones the word index could not answer
+        fuzzy = {}
+        if snapshot.fallback is not None:
+            rows = [row for row in range(len(missing)) if FUZZY_MODE == 'fuse' or row not in found
+                    or found[row][0][0] < MIN_SIMILARITY]
+            if rows:
+                with span('fuzzy'):
+                    scores, idx = snapshot.fallback.search_text([processed[missing[row]] for row in rows], depth)
+                fuzzy.update((row, (scores[n], idx[n])) for n, row in enumerate(rows))
+
+        with span('lookup'):
+            for row, i in enumerate(missing):
+                word = found.get(row, NO_MATCH)
+                if row in fuzzy and FUZZY_MODE == 'fuse':
+                    results[i] = make_result(snapshot, *fuse(word, fuzzy[row], FUZZY_WEIGHT, TOP_K))
+                else:
+                    results[i] = make_result(snapshot, *word)
+                    if row in fuzzy and results[i]['fallback']:
+                        fuzzy_result = make_result(snapshot, *fuzzy[row], FUZZY_MIN_SIMILARITY)
+                        if not fuzzy_result['fallback']:
+                            results[i] = fuzzy_result
+                answer_cache.put(snapshot.version, processed[i], results[i])
+    return results
 
 # Create Dash app
 # Using a different theme for a fresh look, e.g., LUX or MINT
@@ -90,25 +203,102 @@ def get_answer(n_clicks, question):
         return dash.no_update, dash.no_update
     
     try:
-        processed_q = preprocess_text(question)
+        with span('preprocess'):
+            processed_q = preprocess_text(question)
         if not processed_q:
             return html.Div("Please enter a valid question.", className="bot-message error-message"), ""
             
-        query_vec = vectorizer.transform([processed_q])
-        dist, idx = model.kneighbors(query_vec)
-        answer = df.iloc[idx[0][0]]['Answer']
+        answer = lookup_answers([processed_q])[0]['answer']
         
-        return [
-            html.Div([
-                html.P(f"You: {question}", className='user-question message'),
-                html.P(f"Bot: {answer}", className='bot-answer message')
-            ])
-        ], ""
+        with span('render'):
+            return [
+                html.Div([
+                    html.P(f"You: {question}", className='user-question message'),
+                    html.P(f"Bot: {answer}", className='bot-answer message')
+                ])
+            ], ""
     
     except Exception as e:
         print(f"Error processing question: {e}")
         return html.Div("Sorry, I couldn't find an answer to that question at the moment. Please try again later.", className="bot-message error-message"), ""
 
+# Answer many questions in one pass: bulk preprocessing, a single sparse
+# transform and a single top-k search over the whole batch
+def answer_batch(questions):
+    with span('preprocess'):
+        processed = preprocess_batch(questions)
+    valid = [i for i, p in enumerate(processed) if p]
+    found = dict(zip(valid, lookup_answers([processed[i] for i in valid])))
+
+    results = []
+    for i, question in enumerate(questions):
+        result = found.get(i, {'answer': None, 'score': None, 'fallback': True, 'matches': []})
+        results.append({'question': question, **result})
+    return results
+
+# JSON batch endpoint for offline replay jobs
+@server.route('/api/answer_batch', methods=['POST'])
+def answer_batch_endpoint():
+    payload = request.get_json(silent=True)
+    questions = payload.get('questions') if isinstance(payload, dict) else None
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        return jsonify({'error': "Body must be JSON with a 'questions' list of strings"}), 400
+    if len(questions) > MAX_BATCH_SIZE:
+        return jsonify({'error': f"At most {MAX_BATCH_SIZE} questions per request"}), 413
+    return jsonify({'results': answer_batch(questions)})
+
+# Cache hit/miss counters for monitoring
+@server.route('/api/cache_stats')
+def cache_stats_endpoint():
+    return jsonify({**cache_stats(), 'answers': answer_cache.stats()})
+
+# Per-request latency by route; for Dash callbacks this includes
+# deserializing the request and serializing the returned components
+if metrics.METRICS_ENABLED:
+    @server.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_request_time(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'other'
+            metrics.observe_request(route, time.perf_counter() - start)
+        return response
+
+# Stage and request latency histograms in Prometheus format
+@server.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Admin-only sampling profiler for this worker: POST ?seconds=N starts a
+# profile, GET reports its status, GET ?download=1 returns the collapsed stacks
+@server.route('/admin/profile', methods=['GET', 'POST'])
+def profile_endpoint():
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                                                 ADMIN_TOKEN.encode()):
+        return jsonify({'error': "Not found"}), 404
+    if request.method == 'POST':
+        try:
+            seconds = float(request.args.get('seconds', '30'))
+        except ValueError:
+            seconds = 0
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            return jsonify({'error': f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+        try:
+            profile = start_profile(seconds)
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify({'pid': os.getpid(), **profile.status()}), 202
+
+    profile = current_profile()
+    if request.args.get('download'):
+        if profile is None or profile.output is None:
+            return jsonify({'error': "No finished profile in this worker"}), 404
+        return send_file(os.path.abspath(profile.output), mimetype='text/plain', as_attachment=True)
+    return jsonify({'pid': os.getpid(), **(profile.status() if profile else {'running': False})})
+
 # Enhanced CSS styling - added directly for clarity and ease of modification
 app.css.append_css({
     'external_url': (
@@ -294,4 +484,6 @@ app.css.append_css({
 })
 
 if __name__ == '__main__':
+    start_watcher()
+    start_profiler()
     app.run(debug=True)
\ No newline at end of file
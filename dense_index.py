@@ -0,0 +1,235 @@
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+
+from index_store import artifact_path, build_lock, read_artifact, write_artifact
+
+# Dimensions kept by the LSA projection (capped by the corpus shape)
+LSA_RANK = int(os.environ.get('CHATBOT_LSA_RANK', '256'))
+# IVF: number of k-means lists (0 picks ~sqrt(n_docs)) and lists probed per query
+IVF_LISTS = int(os.environ.get('CHATBOT_IVF_LISTS', '0'))
+IVF_PROBE = int(os.environ.get('CHATBOT_IVF_PROBE', '8'))
+# HNSW: graph degree and search beam width
+HNSW_M = int(os.environ.get('CHATBOT_HNSW_M', '16'))
+HNSW_EF = int(os.environ.get('CHATBOT_HNSW_EF', '64'))
+
+
+def normalize_rows(E):
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    E /= norms
+    return E
+
+
+# Latent semantic analysis: a truncated SVD of the TF-IDF matrix maps each
+# sparse row to a dense unit vector of `rank` float32 values, where cosine
+# similarity also rewards related (co-occurring) terms, not only shared ones.
+# Holds the projection and the embedded corpus, both C-contiguous.
+class LSAProjection:
+    def __init__(self, components_t, embeddings=None):
+        # (n_terms, rank), so projecting is one sparse-dense product
+        self.components_t = np.ascontiguousarray(components_t, dtype=np.float32)
+        # (n_docs, rank) unit rows
+        self.embeddings = embeddings
+
+    @classmethod
+    def fit(cls, X, rank=LSA_RANK, seed=0):
+        rank = max(1, min(rank, min(X.shape) - 1))
+        svd = TruncatedSVD(n_components=rank, algorithm='randomized', random_state=seed)
+        svd.fit(X)
+        projection = cls(svd.components_.T)
+        projection.embeddings = projection.transform(X)
+        return projection
+
+    @property
+    def rank(self):
+        return self.components_t.shape[1]
+
+    def transform(self, Q):
+        return normalize_rows(np.asarray(sparse.csr_matrix(Q) @ self.components_t, dtype=np.float32))
+
+    def save(self, path, version):
+        write_artifact(path, {'version': version, 'rank': self.rank},
+                       {'components_t': self.components_t, 'embeddings': self.embeddings})
+
+    @classmethod
+    def load(cls, path):
+        meta, arrays = read_artifact(path)
+        return cls(arrays['components_t'], arrays['embeddings']), meta
+
+
+# The projection stored at path if it was fitted for this index, else None;
+# save is False when path holds another version's artifact
+def load_lsa(path, index):
+    if not os.path.exists(path):
+        return None, True
+    try:
+        projection, meta = LSAProjection.load(path)
+    except Exception as e:
+        print(f"Ignoring unreadable LSA index {path}: {e}")
+        return None, True
+    if (meta['version'] == index.version and projection.components_t.shape[0] == index.X.shape[1]
+            and projection.embeddings.shape[0] == index.X.shape[0]):
+        return projection, True
+    return None, False
+
+
+# Reuse the LSA artifact for this index version and rank if present, else
+# fit it and persist it so other workers and restarts map it instead; one
+# process fits it while the others wait for it. Artifacts are named by a
+# prefix of the version, so a compacted in-memory index ("<hash>+N") finds
+# its base's file: that one is refitted, not reused, and left in place for
+# the processes still serving the base.
+def load_or_build_lsa(index, index_dir, rank=LSA_RANK):
+    path = artifact_path(index_dir, index.version, kind=f'lsa{rank}')
+    projection, save = load_lsa(path, index)
+    if projection is not None:
+        return projection
+    if not save:
+        return fit_lsa(index, rank)
+    with build_lock(path):
+        projection, save = load_lsa(path, index)
+        if projection is None:
+            projection = fit_lsa(index, rank)
+            if save:
+                try:
+                    projection.save(path, index.version)
+                except OSError as e:
+                    print(f"Could not save LSA index to {path}: {e}")
+    return projection
+
+
+def fit_lsa(index, rank):
+    start = time.perf_counter()
+    projection = LSAProjection.fit(index.X, rank)
+    print(f"Fitted LSA rank {projection.rank} in {time.perf_counter() - start:.1f}s "
+          f"({projection.embeddings.nbytes + projection.components_t.nbytes} bytes)")
+    return projection
+
+
+# Best k columns of each row of a dense score matrix, as (scores, indices)
+def top_k_rows(S, k):
+    k = min(k, S.shape[1])
+    part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(S, part, 1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part_scores, order, 1), np.take_along_axis(part, order, 1)
+
+
+# Base for retrieval backends over dense embeddings. It keeps the engine
+# contract of retrieval.py -- search(Q, k) on sparse TF-IDF query rows
+# returning (scores, indices) best first, with -1 for empty queries -- and
+# subclasses only implement _build(E) and search_dense(E, k) on unit vectors.
+class DenseEngine:
+    def __init__(self, X, XT=None, projection=None):
+        self.n_docs = X.shape[0]
+        self.projection = projection or LSAProjection.fit(X)
+        self._build(self.projection.embeddings)
+
+    def _build(self, E):
+        raise NotImplementedError
+
+    def search_dense(self, E, k):
+        raise NotImplementedError
+
+    def search(self, Q, k=1):
+        Q = sparse.csr_matrix(Q)
+        k = min(k, self.n_docs)
+        scores = np.zeros((Q.shape[0], k), dtype=np.float64)
+        indices = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        active = np.flatnonzero(np.diff(Q.indptr))
+        if len(active):
+            scores[active], indices[active] = self.search_dense(self.projection.transform(Q[active]), k)
+        return scores, indices
+
+
+# Exact search in LSA space: the corpus is one contiguous float32 matrix and
+# scoring a batch of queries is a single BLAS matrix product over it. Memory
+# is n_docs x rank x 4 bytes whatever the vocabulary size.
+class LSAIndex(DenseEngine):
+    def _build(self, E):
+        self.E = E
+
+    def search_dense(self, E, k):
+        return top_k_rows(E @ self.E.T, k)
+
+
+# Inverted file index: spherical k-means splits the corpus into lists, a
+# query only scans the IVF_PROBE lists whose centroids it is closest to.
+# Vectors are stored as int8 with one float32 scale per row (about a quarter
+# of float32 storage), laid out contiguously list by list.
+class IVFIndex(DenseEngine):
+    def __init__(self, X, XT=None, projection=None, n_lists=IVF_LISTS, n_probe=IVF_PROBE):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        super().__init__(X, XT, projection)
+
+    def _build(self, E):
+        n_lists = self.n_lists or int(np.sqrt(len(E)))
+        self.centroids, assign = spherical_kmeans(E, max(1, min(n_lists, len(E))))
+        order = np.argsort(assign, kind='stable')
+        self.ids = order.astype(np.int64)
+        self.offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(self.centroids)), out=self.offsets[1:])
+        self.codes, self.scales = quantize_int8(E[order])
+
+    def search_dense(self, E, k):
+        scores = np.zeros((len(E), k), dtype=np.float64)
+        indices = np.full((len(E), k), -1, dtype=np.int64)
+        n_probe = min(self.n_probe, len(self.centroids))
+        _, probes = top_k_rows(E @ self.centroids.T, n_probe)
+        for row, q in enumerate(E):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[row]])
+            if not len(rows):
+                continue
+            cand_scores = (self.codes[rows] @ q) * self.scales[rows]
+            top_scores, top = top_k_rows(cand_scores[None, :], k)
+            n = top.shape[1]
+            scores[row, :n], indices[row, :n] = top_scores[0], self.ids[rows[top[0]]]
+        return scores, indices
+
+
+# Graph-based ANN through the optional hnswlib package (float32 vectors)
+class HNSWIndex(DenseEngine):
+    def _build(self, E):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("Retrieval mode 'hnsw' needs the hnswlib package: pip install hnswlib")
+        self.graph = hnswlib.Index(space='ip', dim=E.shape[1])
+        self.graph.init_index(max_elements=len(E), ef_construction=max(HNSW_EF, 100), M=HNSW_M)
+        self.graph.add_items(E, np.arange(len(E)))
+
+    def search_dense(self, E, k):
+        self.graph.set_ef(max(HNSW_EF, k))
+        labels, distances = self.graph.knn_query(E, k)
+        # Inner-product space reports 1 - dot as the distance
+        return 1 - distances.astype(np.float64), labels.astype(np.int64)
+
+
+def spherical_kmeans(E, n_clusters, iterations=10, seed=0, block=65536):
+    rng = np.random.default_rng(seed)
+    centroids = E[rng.choice(len(E), n_clusters, replace=False)].copy()
+    assign = np.zeros(len(E), dtype=np.int64)
+    for _ in range(iterations):
+        for start in range(0, len(E), block):
+            assign[start:start + block] = np.argmax(E[start:start + block] @ centroids.T, axis=1)
+        members = sparse.csr_matrix((np.ones(len(E), dtype=np.float32), (assign, np.arange(len(E)))),
+                                    shape=(n_clusters, len(E)))
+        sums = np.asarray(members @ E, dtype=np.float32)
+        # Clusters that lost all their members keep their previous centroid
+        empty = np.asarray(members.sum(axis=1)).ravel() == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize_rows(sums)
+    return centroids, assign
+
+
+# Symmetric per-row int8 quantization: E ~= codes * scales[:, None]
+def quantize_int8(E):
+    scales = np.abs(E).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.round(E / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
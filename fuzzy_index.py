@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from index_store import (QueryVectorizer, StringStore, StringTable, artifact_path, build_lock, read_artifact,
+                         write_artifact)
+from retrieval import CosineTopK
+
+# Character n-gram lengths; n-grams are taken inside word boundaries, so a
+# typo only disturbs the few n-grams that overlap it
+NGRAM_RANGE = tuple(int(n) for n in os.environ.get('CHATBOT_FUZZY_NGRAMS', '3,4').split(','))
+
+
+def char_analyzer(ngram_range=NGRAM_RANGE):
+    return TfidfVectorizer(analyzer='char_wb', ngram_range=ngram_range).build_analyzer()
+
+
+# Typo-tolerant index over the processed questions: character n-gram TF-IDF
+# with cosine top-k search. Stored as float32 values with int32 indices (while
+# the nonzeros fit), which halves the footprint of the word index layout;
+# there are many more n-grams per question than words.
+class CharNgramIndex:
+    def __init__(self, vectorizer, X, XT, ngram_range):
+        self.vectorizer = vectorizer
+        self.ngram_range = ngram_range
+        self.engine = CosineTopK(X, XT)
+
+    @classmethod
+    def build(cls, processed, ngram_range=NGRAM_RANGE):
+        tfidf = TfidfVectorizer(analyzer='char_wb', ngram_range=ngram_range, dtype=np.float32)
+        X = tfidf.fit_transform(list(processed)).tocsr()
+        if X.indptr[-1] < np.iinfo(np.int32).max:
+            X.indptr = X.indptr.astype(np.int32)
+            X.indices = X.indices.astype(np.int32)
+        vectorizer = QueryVectorizer.from_terms(tfidf.get_feature_names_out(), tfidf.idf_.astype(np.float32),
+                                                char_analyzer(ngram_range))
+        return cls(vectorizer, X, X.T.tocsr(), ngram_range)
+
+    # Same contract as Snapshot.fallback: (scores, indices) per text, best first
+    def search_text(self, texts, k=1):
+        return self.engine.search(self.vectorizer.transform(texts), k)
+
+    def save(self, path, version):
+        X, XT, terms = self.engine.X, self.engine.XT, self.vectorizer.vocabulary
+        arrays = {'idf': self.vectorizer.idf,
+                  'X.data': X.data, 'X.indices': X.indices, 'X.indptr': X.indptr,
+                  'XT.data': XT.data, 'XT.indices': XT.indices, 'XT.indptr': XT.indptr,
+                  'terms.offsets': terms.store.offsets, 'terms.data': terms.store.data,
+                  'terms.slots': terms.slots}
+        write_artifact(path, {'version': version, 'shape': list(X.shape),
+                              'ngram_range': list(self.ngram_range)}, arrays)
+
+    @classmethod
+    def load(cls, path):
+        meta, arrays = read_artifact(path)
+        ngram_range = tuple(meta['ngram_range'])
+        terms = StringTable(StringStore(arrays['terms.offsets'], arrays['terms.data']), arrays['terms.slots'])
+        n_docs, n_terms = meta['shape']
+        X = sparse.csr_matrix((arrays['X.data'], arrays['X.indices'], arrays['X.indptr']),
+                              shape=(n_docs, n_terms), copy=False)
+        XT = sparse.csr_matrix((arrays['XT.data'], arrays['XT.indices'], arrays['XT.indptr']),
+                               shape=(n_terms, n_docs), copy=False)
+        return cls(QueryVectorizer(terms, arrays['idf'], char_analyzer(ngram_range)), X, XT, ngram_range), meta
+
+
+# The n-gram index stored at path if it was built for this index and n-gram
+# range, else None; save is False when path holds another version's artifact
+def load_fuzzy_index(path, index, ngram_range):
+    if not os.path.exists(path):
+        return None, True
+    try:
+        fuzzy, meta = CharNgramIndex.load(path)
+    except Exception as e:
+        print(f"Ignoring unreadable fuzzy index {path}: {e}")
+        return None, True
+    if meta['version'] != index.version or meta['shape'][0] != len(index.processed):
+        return None, False
+    return (fuzzy if tuple(meta['ngram_range']) == tuple(ngram_range) else None), True
+
+
+# Reuse the fuzzy artifact for this index version if present, else build it
+# from the index's processed questions and persist it; one process builds it
+# while the others wait for it. As with the LSA artifact, a compacted
+# in-memory index ("<hash>+N") finds its base's file: it is rebuilt so the
+# new rows join it, and the base's file is kept.
+def load_or_build_fuzzy_index(index, index_dir, ngram_range=NGRAM_RANGE):
+    # The n-gram range is part of the name, so processes with different
+    # CHATBOT_FUZZY_NGRAMS keep separate artifacts
+    path = artifact_path(index_dir, index.version, kind=f"fuzzy{'-'.join(map(str, ngram_range))}")
+    fuzzy, save = load_fuzzy_index(path, index, ngram_range)
+    if fuzzy is not None:
+        return fuzzy
+    if not save:
+        return CharNgramIndex.build(index.processed, ngram_range)
+    with build_lock(path):
+        fuzzy, save = load_fuzzy_index(path, index, ngram_range)
+        if fuzzy is None:
+            fuzzy = CharNgramIndex.build(index.processed, ngram_range)
+            if save:
+                try:
+                    fuzzy.save(path, index.version)
+                except OSError as e:
+                    print(f"Could not save fuzzy index to {path}: {e}")
+    return fuzzy
+
+
+# Weighted score fusion (CombSUM) of two top-k result rows over the same
+# document numbering; a document missing from one list contributes 0 there
+def fuse(word, fuzzy, weight, k):
+    scores = {}
+    for (row_scores, row_idx), w in ((word, 1 - weight), (fuzzy, weight)):
+        for score, i in zip(row_scores, row_idx):
+            if i >= 0 and score > 0:
+                scores[int(i)] = scores.get(int(i), 0.0) + w * float(score)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return (np.array([s for _, s in ranked]), np.array([i for i, _ in ranked], dtype=np.int64))
@@ -0,0 +1,28 @@
+# Production entry point: gunicorn -c gunicorn.conf.py
+import gc
+import os
+
+wsgi_app = 'chatbot:server'
+bind = os.environ.get('CHATBOT_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('CHATBOT_WORKERS', os.cpu_count() or 1))
+
+# Import chatbot.py, and so load the index, once in the master. The index
+# arrays are read-only mmaps of the artifact, and vocabulary/lemma lookups go
+# through hash slots in those arrays rather than dicts, so forked workers
+# share the same physical pages instead of each holding a copy.
+preload_app = True
+
+
+# Move everything the master has allocated into the permanent GC generation
+# so collections in the workers never write to (and un-share) those objects
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+# The dataset watcher and profiler threads live in each worker, not the master.
+# On a dataset change only one worker builds the new artifact (see
+# load_or_build_index); the others wait for it and map it.
+def post_fork(server, worker):
+    import chatbot
+    chatbot.start_watcher()
+    chatbot.start_profiler()
@@ -0,0 +1,653 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from nlp_resources import check_resources
+from preprocessing import (BUILD_CHUNK_SIZE, BUILD_WORKERS, PREPROCESSOR, build_lemma_table,
+                           preprocess_corpus, preprocess_stream)
+
+# Bump whenever the on-disk layout or the fitted pipeline changes so stale
+# artifacts are rebuilt instead of loaded
+FORMAT_VERSION = 3
+MAGIC = b'CHATIDX\x00'
+ALIGN = 64
+# Optional word list (one per line) added to the corpus tokens when
+# precomputing lemmas for the fast preprocessor
+LEMMA_VOCAB_PATH = os.environ.get('CHATBOT_LEMMA_VOCAB')
+# meta['kind'] of compiled dataset files, which share the artifact container
+DATASET_KIND = 'dataset'
+# A build lock older than this many seconds was left by a builder that died
+BUILD_LOCK_TIMEOUT = float(os.environ.get('CHATBOT_BUILD_LOCK_TIMEOUT', '3600'))
+
+
+# Content hash of the dataset file, used as the artifact version key
+def dataset_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_path(index_dir, version, kind='chatbot'):
+    return os.path.join(index_dir, f"{kind}-v{FORMAT_VERSION}-{PREPROCESSOR}-{version[:16]}.idx")
+
+
+def clean_dataset(df):
+    # Clean data - ensure required columns exist
+    if 'Question' not in df.columns or 'Answer' not in df.columns:
+        raise ValueError("CSV must contain 'Question' and 'Answer' columns")
+    df = df.dropna(subset=['Question', 'Answer'])
+    df['Question'] = df['Question'].astype(str)
+    df['Answer'] = df['Answer'].astype(str)
+    return df
+
+
+# Load and clean the Q/A dataset from CSV (or a compiled dataset)
+def load_dataset(path):
+    if is_compiled_dataset(path):
+        data = load_compiled_dataset(path)
+        return pd.DataFrame({'Question': list(data.questions), 'Answer': list(data.answers)})
+    return clean_dataset(pd.read_csv(path))
+
+
+# Same as load_dataset, but reads and cleans chunksize rows at a time
+def iter_dataset_chunks(path, chunksize=BUILD_CHUNK_SIZE):
+    with pd.read_csv(path, chunksize=chunksize, usecols=['Question', 'Answer']) as reader:
+        for chunk in reader:
+            yield clean_dataset(chunk)
+
+
+# Strings are stored as one contiguous UTF-8 buffer plus an offsets array
+def encode_strings(values):
+    encoded = [str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+# Read-only sequence of strings over an offsets array and a UTF-8 buffer.
+# Backed by the artifact mmap, the bytes live once in the page cache for all
+# workers and only the requested entries are ever decoded.
+class StringStore:
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+        self._buf = memoryview(data).cast('B') if len(data) else b''
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*encode_strings(values))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._buf[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def take(self, indices):
+        return [self[int(i)] for i in indices]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.data.nbytes
+
+
+# Open-addressing hash index over a StringStore: string -> position. The
+# slot array is plain int32 data, so it can live in the artifact mmap and
+# lookups never touch long-lived Python objects (no refcount writes that
+# would un-share copy-on-write pages after a fork).
+class StringTable:
+    def __init__(self, store, slots):
+        self.store = store
+        self.slots = slots
+        self._mask = len(slots) - 1
+
+    @classmethod
+    def build(cls, store):
+        size = 8
+        while size < 2 * len(store):
+            size *= 2
+        slots = [-1] * size
+        for i, value in enumerate(store):
+            h = zlib.crc32(value.encode('utf-8')) & (size - 1)
+            while slots[h] != -1:
+                h = (h + 1) & (size - 1)
+            slots[h] = i
+        return cls(store, np.asarray(slots, dtype=np.int32))
+
+    # Position of value in the store, or -1
+    def find(self, value):
+        key = value.encode('utf-8')
+        buf, offsets, slots = self.store._buf, self.store.offsets, self.slots
+        h = zlib.crc32(key) & self._mask
+        while True:
+            i = slots[h]
+            if i < 0:
+                return -1
+            if buf[offsets[i]:offsets[i + 1]] == key:
+                return i
+            h = (h + 1) & self._mask
+
+    def __len__(self):
+        return len(self.store)
+
+
+# Read-only string -> string mapping over two stores, e.g. the lemma table
+class StringMap:
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, mapping):
+        return cls(StringTable.build(StringStore.from_list(mapping.keys())),
+                   StringStore.from_list(mapping.values()))
+
+    def get(self, key, default=None):
+        i = self.keys.find(key)
+        return default if i < 0 else self.values[i]
+
+    def items(self):
+        return zip(self.keys.store, self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Query-time replacement for a fitted TfidfVectorizer: same analyzer, raw
+# counts times IDF, L2-normalized rows. Vocabulary lookups go through a
+# StringTable instead of a dict, and sklearn's per-call validation is skipped.
+class QueryVectorizer:
+    def __init__(self, vocabulary, idf, analyzer=None):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        # Must match the analyzer the model was fitted with; word tokens by default
+        self.analyzer = analyzer or TfidfVectorizer().build_analyzer()
+
+    @classmethod
+    def from_terms(cls, terms, idf, analyzer=None):
+        return cls(StringTable.build(StringStore.from_list(terms)), np.asarray(idf), analyzer)
+
+    # normalize=False leaves rows unscaled, for stacking with other term columns
+    def transform(self, docs, normalize=True):
+        indptr, indices, counts = [0], [], []
+        for doc in docs:
+            term_counts = Counter()
+            for token in self.analyzer(doc):
+                j = self.vocabulary.find(token)
+                if j >= 0:
+                    term_counts[j] += 1
+            indices.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+            indptr.append(len(indices))
+        indices = np.asarray(indices, dtype=np.int32)
+        X = sparse.csr_matrix((np.asarray(counts, dtype=self.idf.dtype) * self.idf[indices], indices, indptr),
+                              shape=(len(docs), len(self.vocabulary)))
+        X.sort_indices()
+        return normalize_csr(X) if normalize else X
+
+
+# Scale the rows of a CSR matrix to unit L2 norm in place; empty rows stay empty
+def normalize_csr(X):
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    X.data /= np.repeat(norms, np.diff(X.indptr))
+    return X
+
+
+# Artifact layout: MAGIC, 8-byte header length, JSON header, then each array
+# section aligned to ALIGN bytes so it can be viewed straight out of the mmap
+def write_artifact(path, meta, arrays):
+    sections = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        offset = -(-offset // ALIGN) * ALIGN
+        sections[name] = {'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+        offset += arr.nbytes
+    header = json.dumps({'format': FORMAT_VERSION, 'meta': meta, 'sections': sections}).encode('utf-8')
+    base = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(base + sections[name]['offset'])
+            f.write(np.ascontiguousarray(arr).data)
+    # Atomic publish so concurrent readers never see a partial file
+    os.replace(tmp_path, path)
+
+
+def read_artifact(path):
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    if mm[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError(f"{path} is not a chatbot index artifact")
+    header_len = int.from_bytes(mm[len(MAGIC):len(MAGIC) + 8].tobytes(), 'little')
+    start = len(MAGIC) + 8
+    header = json.loads(mm[start:start + header_len].tobytes().decode('utf-8'))
+    if header['format'] != FORMAT_VERSION:
+        raise ValueError(f"{path} has format {header['format']}, expected {FORMAT_VERSION}")
+    base = -(-(start + header_len) // ALIGN) * ALIGN
+
+    arrays = {}
+    for name, sec in header['sections'].items():
+        dtype = np.dtype(sec['dtype'])
+        count = int(np.prod(sec['shape']))
+        begin = base + sec['offset']
+        arrays[name] = mm[begin:begin + count * dtype.itemsize].view(dtype).reshape(sec['shape'])
+    return header['meta'], arrays
+
+
+# Everything the answer pipeline needs, built once and reused
+class ChatIndex:
+    def __init__(self, vectorizer, X, XT, questions, answers, processed, lemmas, version):
+        self.vectorizer = vectorizer
+        self.X = X
+        # Term-major copy of X (postings lists), used by the retrieval engines
+        self.XT = XT
+        self.questions = questions
+        self.answers = answers
+        self.processed = processed
+        self.lemmas = lemmas
+        self.version = version
+
+
+def load_lemma_vocab(path):
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_index(df, version, lemma_vocab_path=LEMMA_VOCAB_PATH, workers=BUILD_WORKERS):
+    processed, lemmas = preprocess_corpus(df['Question'], workers)
+    lemmas.update(build_lemma_table(load_lemma_vocab(lemma_vocab_path)))
+    return index_from_processed(df['Question'], df['Answer'], processed, lemmas, version)
+
+
+def as_store(values):
+    return values if isinstance(values, StringStore) else StringStore.from_list(values)
+
+
+# Fit the model on questions that have already been preprocessed. Columns
+# and lemmas may be lists and a dict, or stores mapped from a compiled dataset.
+def index_from_processed(questions, answers, processed, lemmas, version):
+    tfidf = TfidfVectorizer()
+    X = tfidf.fit_transform(processed).tocsr()
+    vectorizer = QueryVectorizer.from_terms(tfidf.get_feature_names_out(), tfidf.idf_)
+    if not isinstance(lemmas, StringMap):
+        lemmas = StringMap.from_dict(lemmas)
+    return ChatIndex(vectorizer, X, X.T.tocsr(), as_store(questions), as_store(answers),
+                     as_store(processed), lemmas, version)
+
+
+# Array sections shared by both build paths: vocabulary and its hash slots,
+# IDF, the document matrix, its postings and the lemma table
+def model_sections(vocabulary, idf, X, XT, lemmas):
+    arrays = {'idf': idf,
+              'X.data': X.data, 'X.indices': X.indices, 'X.indptr': X.indptr,
+              'XT.data': XT.data, 'XT.indices': XT.indices, 'XT.indptr': XT.indptr}
+    for name, store in (('terms', vocabulary.store), ('lemmas.keys', lemmas.keys.store),
+                        ('lemmas.values', lemmas.values)):
+        arrays[f'{name}.offsets'], arrays[f'{name}.data'] = store.offsets, store.data
+    arrays['terms.slots'] = vocabulary.slots
+    arrays['lemmas.keys.slots'] = lemmas.keys.slots
+    return arrays
+
+
+# Builds the artifact from a stream of chunks without holding the dataset in
+# memory. Term counts use a vocabulary that grows as chunks arrive and are
+# spooled to disk together with the strings; IDF weighting, column ordering
+# and L2 normalization happen once in write(), matching TfidfVectorizer.
+class StreamingIndexBuilder:
+    SPOOLS = ('indices', 'counts', 'row_nnz',
+              'questions', 'questions.len', 'answers', 'answers.len', 'processed', 'processed.len')
+
+    def __init__(self, spool_dir=None):
+        self.analyzer = TfidfVectorizer().build_analyzer()
+        self.vocab = {}
+        self.lemmas = {}
+        self.n_docs = 0
+        self.spool_dir = tempfile.mkdtemp(prefix='chatbot-build-', dir=spool_dir)
+        self.files = {name: open(os.path.join(self.spool_dir, name), 'wb') for name in self.SPOOLS}
+
+    def add(self, questions, answers, processed, lemmas):
+        indices, counts, row_nnz = [], [], []
+        for doc in processed:
+            term_counts = Counter(self.analyzer(doc))
+            for term, count in term_counts.items():
+                indices.append(self.vocab.setdefault(term, len(self.vocab)))
+                counts.append(count)
+            row_nnz.append(len(term_counts))
+        np.asarray(indices, dtype=np.int32).tofile(self.files['indices'])
+        np.asarray(counts, dtype=np.float64).tofile(self.files['counts'])
+        np.asarray(row_nnz, dtype=np.int64).tofile(self.files['row_nnz'])
+        for name, values in (('questions', questions), ('answers', answers), ('processed', processed)):
+            encoded = [str(v).encode('utf-8') for v in values]
+            self.files[name].write(b''.join(encoded))
+            np.asarray([len(b) for b in encoded], dtype=np.int64).tofile(self.files[f'{name}.len'])
+        self.lemmas.update(lemmas)
+        self.n_docs += len(processed)
+
+    def _spool(self, name, dtype):
+        path = os.path.join(self.spool_dir, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def _offsets(self, name):
+        offsets = np.zeros(self.n_docs + 1, dtype=np.int64)
+        np.cumsum(self._spool(f'{name}.len', np.int64), out=offsets[1:])
+        return offsets
+
+    def write(self, path, version):
+        for f in self.files.values():
+            f.close()
+        if not self.vocab:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+
+        # Columns in sorted term order, as TfidfVectorizer lays them out
+        terms = sorted(self.vocab)
+        remap = np.empty(len(terms), dtype=np.int32)
+        remap[[self.vocab[t] for t in terms]] = np.arange(len(terms), dtype=np.int32)
+        indices = remap[self._spool('indices', np.int32)]
+        indptr = np.zeros(self.n_docs + 1, dtype=np.int64)
+        np.cumsum(self._spool('row_nnz', np.int64), out=indptr[1:])
+
+        # Smoothed IDF; each term occurs at most once per row, so a bincount
+        # over the column indices is the document frequency
+        doc_freq = np.bincount(indices, minlength=len(terms))
+        idf = np.log((1 + self.n_docs) / (1 + doc_freq)) + 1
+        X = sparse.csr_matrix((self._spool('counts', np.float64) * idf[indices], indices, indptr),
+                              shape=(self.n_docs, len(terms)))
+        X.sort_indices()
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        X.data /= np.repeat(norms, np.diff(X.indptr))
+        if X.indptr[-1] < np.iinfo(np.int32).max:
+            X.indptr = X.indptr.astype(np.int32)
+
+        vocabulary = StringTable.build(StringStore.from_list(terms))
+        arrays = model_sections(vocabulary, idf, X, X.T.tocsr(), StringMap.from_dict(self.lemmas))
+        for name in ('questions', 'answers', 'processed'):
+            arrays[f'{name}.offsets'] = self._offsets(name)
+            arrays[f'{name}.data'] = self._spool(name, np.uint8)
+        write_artifact(path, {'version': version, 'shape': list(X.shape)}, arrays)
+
+    # Only the string columns and the lemma table, as a compiled dataset
+    def write_dataset(self, path, meta):
+        for f in self.files.values():
+            f.close()
+        arrays = {}
+        for name in ('questions', 'answers', 'processed'):
+            arrays[f'{name}.offsets'] = self._offsets(name)
+            arrays[f'{name}.data'] = self._spool(name, np.uint8)
+        lemmas = StringMap.from_dict(self.lemmas)
+        for name, store in (('lemmas.keys', lemmas.keys.store), ('lemmas.values', lemmas.values)):
+            arrays[f'{name}.offsets'], arrays[f'{name}.data'] = store.offsets, store.data
+        arrays['lemmas.keys.slots'] = lemmas.keys.slots
+        write_artifact(path, {**meta, 'kind': DATASET_KIND, 'rows': self.n_docs}, arrays)
+
+    def cleanup(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+# Stream the CSV through preprocessing into a builder, then write(builder)
+def stream_dataset(dataset_path, path, write, lemma_vocab_path=LEMMA_VOCAB_PATH,
+                   workers=BUILD_WORKERS, chunksize=BUILD_CHUNK_SIZE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    builder = StreamingIndexBuilder(os.path.dirname(path) or '.')
+    try:
+        chunks = ((chunk, chunk['Question'].tolist()) for chunk in iter_dataset_chunks(dataset_path, chunksize))
+        for chunk, processed, lemmas in preprocess_stream(chunks, workers):
+            builder.add(chunk['Question'].tolist(), chunk['Answer'].tolist(), processed, lemmas)
+        builder.lemmas.update(build_lemma_table(load_lemma_vocab(lemma_vocab_path)))
+        write(builder)
+    finally:
+        builder.cleanup()
+
+
+# Stream the CSV through preprocessing into the artifact at path
+def build_index_streaming(dataset_path, path, version, lemma_vocab_path=LEMMA_VOCAB_PATH,
+                          workers=BUILD_WORKERS, chunksize=BUILD_CHUNK_SIZE):
+    stream_dataset(dataset_path, path, lambda builder: builder.write(path, version),
+                   lemma_vocab_path, workers, chunksize)
+
+
+# Compiled dataset: Question, Answer and the preprocessed questions as string
+# sections, plus their lemma table, in the artifact container. Startup maps
+# it instead of parsing CSV, and skips preprocessing when it was compiled
+# with the same preprocessor.
+class CompiledDataset:
+    def __init__(self, questions, answers, processed, lemmas, preprocessor):
+        self.questions = questions
+        self.answers = answers
+        self.processed = processed
+        self.lemmas = lemmas
+        self.preprocessor = preprocessor
+
+    def __len__(self):
+        return len(self.questions)
+
+
+def compile_dataset(dataset_path, path, lemma_vocab_path=LEMMA_VOCAB_PATH,
+                    workers=BUILD_WORKERS, chunksize=BUILD_CHUNK_SIZE):
+    meta = {'preprocessor': PREPROCESSOR, 'source': dataset_hash(dataset_path)}
+    stream_dataset(dataset_path, path, lambda builder: builder.write_dataset(path, meta),
+                   lemma_vocab_path, workers, chunksize)
+
+
+def is_compiled_dataset(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_compiled_dataset(path):
+    meta, arrays = read_artifact(path)
+    if meta.get('kind') != DATASET_KIND:
+        raise ValueError(f"{path} is not a compiled dataset")
+
+    def strings(name):
+        return StringStore(arrays[f'{name}.offsets'], arrays[f'{name}.data'])
+
+    lemmas = StringMap(StringTable(strings('lemmas.keys'), arrays['lemmas.keys.slots']),
+                       strings('lemmas.values'))
+    return CompiledDataset(strings('questions'), strings('answers'), strings('processed'), lemmas,
+                           meta['preprocessor'])
+
+
+def index_from_compiled(path, version):
+    data = load_compiled_dataset(path)
+    processed, lemmas = data.processed, data.lemmas
+    if data.preprocessor != PREPROCESSOR:
+        print(f"{path} was compiled with the {data.preprocessor} preprocessor, re-preprocessing")
+        processed, lemmas = preprocess_corpus(data.questions)
+    return index_from_processed(data.questions, data.answers, processed, lemmas, version)
+
+
+def save_index(index, path):
+    arrays = model_sections(index.vectorizer.vocabulary, index.vectorizer.idf,
+                            index.X, index.XT, index.lemmas)
+    for name in ('questions', 'answers', 'processed'):
+        store = getattr(index, name)
+        arrays[f'{name}.offsets'], arrays[f'{name}.data'] = store.offsets, store.data
+    meta = {'version': index.version, 'shape': list(index.X.shape)}
+    write_artifact(path, meta, arrays)
+
+
+def load_index(path):
+    meta, arrays = read_artifact(path)
+
+    def strings(name):
+        return StringStore(arrays[f'{name}.offsets'], arrays[f'{name}.data'])
+
+    # Every array stays backed by the mmap, shared through the page cache;
+    # nothing here is proportional to the corpus in Python objects
+    vectorizer = QueryVectorizer(StringTable(strings('terms'), arrays['terms.slots']), arrays['idf'])
+    n_docs, n_terms = meta['shape']
+    X = sparse.csr_matrix((arrays['X.data'], arrays['X.indices'], arrays['X.indptr']),
+                          shape=(n_docs, n_terms), copy=False)
+    XT = sparse.csr_matrix((arrays['XT.data'], arrays['XT.indices'], arrays['XT.indptr']),
+                           shape=(n_terms, n_docs), copy=False)
+    lemmas = StringMap(StringTable(strings('lemmas.keys'), arrays['lemmas.keys.slots']),
+                       strings('lemmas.values'))
+    return ChatIndex(vectorizer, X, XT, strings('questions'), strings('answers'),
+                     strings('processed'), lemmas, meta['version'])
+
+
+# Fast path for startup: reuse the artifact for this exact dataset if present,
+# otherwise build it and persist it for the next process
+def _try_lock(lock_path):
+    try:
+        if time.time() - os.path.getmtime(lock_path) > BUILD_LOCK_TIMEOUT:
+            os.unlink(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        return False
+
+
+def _lock_held(lock_path):
+    try:
+        return time.time() - os.path.getmtime(lock_path) <= BUILD_LOCK_TIMEOUT
+    except OSError:
+        return False
+
+
+# Serializes building one artifact across processes (all server workers, and
+# hosts sharing the index dir) through a lock file created with O_EXCL next
+# to it. If another process holds the lock, waits until it has published the
+# artifact or given up; callers should look for the artifact again inside the
+# block before building it. Without a writable dir the block runs unlocked.
+@contextlib.contextmanager
+def build_lock(path, poll=0.5):
+    lock_path = f"{path}.lock"
+    owned = _try_lock(lock_path)
+    if not owned:
+        while not os.path.exists(path) and _lock_held(lock_path):
+            time.sleep(poll)
+        owned = not os.path.exists(path) and _try_lock(lock_path)
+    try:
+        yield
+    finally:
+        if owned:
+            with contextlib.suppress(OSError):
+                os.unlink(lock_path)
+
+
+# Write the index artifact for the dataset at path. isolate=True runs the
+# build in a fresh interpreter (this module's CLI), for rebuilds inside a
+# serving process: the preprocessing pool is then not forked from a
+# multi-threaded process, and neither it nor the TF-IDF fit competes with
+# request threads for the GIL.
+def build_artifact(dataset_path, path, version, lemma_vocab_path=LEMMA_VOCAB_PATH,
+                   workers=BUILD_WORKERS, chunksize=BUILD_CHUNK_SIZE, isolate=False):
+    if isolate:
+        cmd = [sys.executable, os.path.abspath(__file__), '--dataset', dataset_path, '--output', path,
+               '--version', version, '--workers', str(workers), '--chunk-size', str(chunksize)]
+        if lemma_vocab_path:
+            cmd += ['--lemma-vocab', lemma_vocab_path]
+        subprocess.run(cmd, check=True)
+    elif is_compiled_dataset(dataset_path):
+        save_index(index_from_compiled(dataset_path, version), path)
+    else:
+        build_index_streaming(dataset_path, path, version, lemma_vocab_path, workers, chunksize)
+
+
+def load_or_build_index(dataset_path, index_dir, workers=BUILD_WORKERS, isolate=False):
+    version = dataset_hash(dataset_path)
+    path = artifact_path(index_dir, version)
+    if os.path.exists(path):
+        try:
+            return load_index(path)
+        except Exception as e:
+            print(f"Ignoring unreadable index {path}: {e}")
+
+    with contextlib.suppress(OSError):
+        os.makedirs(index_dir, exist_ok=True)
+    if not os.access(index_dir, os.W_OK):
+        # Index dir not writable: build into a scratch file, map it, unlink it
+        print(f"Index dir {index_dir} is not writable; building {os.path.basename(path)} in a scratch file")
+        fd, scratch = tempfile.mkstemp(suffix='.idx')
+        os.close(fd)
+        try:
+            build_artifact(dataset_path, scratch, version, workers=workers, isolate=isolate)
+            return load_index(scratch)
+        finally:
+            os.unlink(scratch)
+
+    # One process builds a given version; the others wait and map its artifact
+    with build_lock(path):
+        if os.path.exists(path):
+            try:
+                return load_index(path)
+            except Exception as e:
+                print(f"Ignoring unreadable index {path}: {e}")
+        build_artifact(dataset_path, path, version, workers=workers, isolate=isolate)
+    return load_index(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chatbot index artifact")
+    parser.add_argument('--dataset', default='chatbot_dataset.csv')
+    parser.add_argument('--index-dir', default='index')
+    parser.add_argument('--lemma-vocab', default=LEMMA_VOCAB_PATH,
+                        help="extra words to precompute lemmas for, one per line")
+    parser.add_argument('--workers', type=int, default=BUILD_WORKERS,
+                        help="processes used to preprocess the corpus")
+    parser.add_argument('--chunk-size', type=int, default=BUILD_CHUNK_SIZE,
+                        help="CSV rows read and preprocessed per chunk")
+    parser.add_argument('--compile-dataset', metavar='PATH',
+                        help="convert the CSV dataset into a compiled dataset at PATH instead of building the index")
+    parser.add_argument('--output', help="write the index artifact here instead of under --index-dir")
+    parser.add_argument('--version', help="version recorded in the artifact (default: hash of the dataset)")
+    args = parser.parse_args()
+
+    check_resources()
+    if args.compile_dataset:
+        compile_dataset(args.dataset, args.compile_dataset, args.lemma_vocab, args.workers, args.chunk_size)
+        data = load_compiled_dataset(args.compile_dataset)
+        print(f"Wrote {args.compile_dataset} ({len(data)} rows, {data.preprocessor} preprocessor)")
+        return
+    version = args.version or dataset_hash(args.dataset)
+    path = args.output or artifact_path(args.index_dir, version)
+    build_artifact(args.dataset, path, version, args.lemma_vocab, args.workers, args.chunk_size)
+    index = load_index(path)
+    print(f"Wrote {path} ({index.X.shape[0]} rows, {index.X.shape[1]} terms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from dense_index import DenseEngine, top_k_rows
+from index_store import (QueryVectorizer, clean_dataset, index_from_processed, is_compiled_dataset,
+                         load_or_build_index, normalize_csr)
+from preprocessing import build_lemma_table, preprocess_batch
+from retrieval import CosineTopK
+
+# Fold the delta segment into a freshly fitted index once it reaches this size
+DELTA_MAX_ROWS = int(os.environ.get('CHATBOT_DELTA_MAX_ROWS', '1000'))
+# Preprocessing processes for rebuilds while serving; the default keeps the
+# rebuild to one core next to the request threads
+RELOAD_WORKERS = int(os.environ.get('CHATBOT_RELOAD_WORKERS', '1'))
+
+
+# Rows appended since the base index was built. Terms the base vocabulary
+# already has keep their base IDF (IDF drift is deferred to compaction);
+# terms it lacks form an extension vocabulary numbered after the base terms,
+# with a provisional IDF smoothed as TfidfVectorizer does, from their document
+# frequency in the delta over base plus delta rows. Rows and queries are
+# vectorized over both, so no term of an appended row is dropped.
+#
+# With a dense base engine, pass its LSA projection: the base-term part of
+# each row is scored in LSA space (scaled by that part's share of the row
+# norm) and the extension terms by their sparse dot product, so delta scores
+# are on the same scale as the base engine's.
+class DeltaSegment:
+    def __init__(self, questions, answers, processed, index, projection=None):
+        self.questions = questions
+        self.answers = answers
+        self.processed = processed
+        self.index = index
+        self.projection = projection
+        self.n_base_terms = index.X.shape[1]
+        vocabulary, analyzer = index.vectorizer.vocabulary, index.vectorizer.analyzer
+        df = Counter(term for text in processed for term in set(analyzer(text)) if vocabulary.find(term) < 0)
+        self.extension = None
+        if df:
+            terms = sorted(df)
+            n_docs = index.X.shape[0] + len(processed)
+            idf = np.log((1 + n_docs) / (1 + np.array([df[t] for t in terms]))) + 1
+            self.extension = QueryVectorizer.from_terms(terms, idf.astype(index.vectorizer.idf.dtype), analyzer)
+        self.X = self.transform(processed)
+        if projection is None:
+            self.engine = CosineTopK(self.X)
+        else:
+            self.E = self._embed(self.X)
+
+    # Base terms then extension terms, one unit row per text
+    def transform(self, texts):
+        if self.extension is None:
+            return self.index.vectorizer.transform(texts)
+        return normalize_csr(sparse.hstack([self.index.vectorizer.transform(texts, normalize=False),
+                                            self.extension.transform(texts, normalize=False)]).tocsr())
+
+    # LSA embedding of the base-term part, scaled by that part's norm
+    def _embed(self, X):
+        base = X[:, :self.n_base_terms]
+        norms = np.sqrt(np.asarray(base.multiply(base).sum(axis=1)))
+        return self.projection.transform(base) * norms
+
+    def search(self, Q, k=1):
+        if self.projection is None:
+            return self.engine.search(Q, k)
+        Q = sparse.csr_matrix(Q)
+        S = self._embed(Q) @ self.E.T
+        if self.extension is not None:
+            S += (Q[:, self.n_base_terms:] @ self.X[:, self.n_base_terms:].T).toarray()
+        scores, indices = top_k_rows(S, k)
+        empty = np.diff(Q.indptr) == 0
+        scores[empty], indices[empty] = 0, -1
+        return scores.astype(np.float64), indices.astype(np.int64)
+
+    def extend(self, questions, answers, processed):
+        return DeltaSegment(self.questions + questions, self.answers + answers,
+                            self.processed + processed, self.index, self.projection)
+
+    def __len__(self):
+        return len(self.questions)
+
+
+# Everything one request needs, bundled so it can be swapped as a unit.
+# Requests read LiveIndex.current once and use that snapshot throughout, so a
+# reload never changes the index underneath an in-flight request.
+class Snapshot:
+    def __init__(self, index, engine, version, delta=None, base_version=None, fallback=None):
+        self.index = index
+        self.engine = engine
+        self.version = version
+        self.delta = delta
+        # Version of the base index alone, before any delta rows
+        self.base_version = base_version or version
+        # Optional backup index for questions the word index cannot answer,
+        # such as a CharNgramIndex: anything with
+        # search_text(texts, k) -> (scores, indices) over the base rows
+        self.fallback = fallback
+
+    # Query rows for search(): the base vocabulary plus any delta extension terms
+    def transform(self, texts):
+        if self.delta is None:
+            return self.index.vectorizer.transform(texts)
+        return self.delta.transform(texts)
+
+    # Top-k cosine matches across the base index and the delta segment, as
+    # (scores, indices) best first; delta rows are numbered after the base rows
+    def search(self, Q, k=1):
+        n_terms = self.index.X.shape[1]
+        if Q.shape[1] == n_terms:
+            scores, idx = self.engine.search(Q, k)
+        else:
+            # Base documents have no weight on extension terms: score them on
+            # the base-term columns, which keeps sparse scores true cosines in
+            # the extended space; dense engines renormalize queries, so their
+            # scores are scaled back down by the base part's norm
+            base = sparse.csr_matrix(Q)[:, :n_terms]
+            scores, idx = self.engine.search(base, k)
+            if isinstance(self.engine, DenseEngine):
+                scores = scores * np.sqrt(np.asarray(base.multiply(base).sum(axis=1)))
+        if not self.delta:
+            return scores, idx
+        delta_scores, delta_idx = self.delta.search(Q, k)
+        scores = np.hstack([scores, delta_scores])
+        idx = np.hstack([idx, np.where(delta_idx >= 0, delta_idx + len(self.index.answers), -1)])
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(scores, order, 1), np.take_along_axis(idx, order, 1)
+
+    def answers_for(self, indices):
+        n_base = len(self.index.answers)
+        return [self.index.answers[int(i)] if i < n_base else self.delta.answers[int(i) - n_base]
+                for i in indices]
+
+
+# Holds the current snapshot and keeps it in sync with the dataset file.
+# Readers never take a lock: publishing a new snapshot is a single reference
+# assignment. Appends to the file are applied incrementally as a delta
+# segment; any other change triggers a full rebuild in the background.
+class LiveIndex:
+    def __init__(self, dataset_path, index_dir, index, make_snapshot, on_swap=None):
+        self.dataset_path = dataset_path
+        self.index_dir = index_dir
+        self.make_snapshot = make_snapshot
+        self.on_swap = on_swap
+        self.current = make_snapshot(index)
+        self.reloads = 0
+        self._reload_lock = threading.Lock()
+        self._compacting = False
+        self._watcher = None
+        self._stat = self._dataset_stat()
+        # Hash and size of the file contents the current snapshot reflects
+        self.dataset_version = index.version
+        self._dataset_size = self._stat[1] if self._stat else 0
+
+    def _dataset_stat(self):
+        try:
+            st = os.stat(self.dataset_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _publish(self, snapshot):
+        self.current = snapshot
+        if self.on_swap:
+            self.on_swap(snapshot)
+        return snapshot
+
+    def swap(self, index):
+        snapshot = self._publish(self.make_snapshot(index))
+        self.reloads += 1
+        return snapshot
+
+    # Build (or load) the index for the dataset as it is now and publish it.
+    # The build runs in a separate interpreter, and only in one process per
+    # dataset version: every other worker waits for its artifact and maps it.
+    def reload(self):
+        with self._reload_lock:
+            stat = self._dataset_stat()
+            index = load_or_build_index(self.dataset_path, self.index_dir, RELOAD_WORKERS, isolate=True)
+            if index.version == self.current.index.version and not self.current.delta:
+                return self.current
+            self.dataset_version = index.version
+            self._dataset_size = stat[1] if stat else 0
+            return self.swap(index)
+
+    # Append Q/A pairs without refitting: they go into the delta segment and
+    # are searchable as soon as this returns. Pairs added directly (rather
+    # than appended to the dataset file) are not persisted.
+    def add_pairs(self, questions, answers, dataset_version=None):
+        questions, answers = list(questions), list(answers)
+        if not questions:
+            return self.current
+        processed = preprocess_batch(questions)
+        with self._reload_lock:
+            snapshot = self._publish(self._extend(self.current, questions, answers, processed))
+            # Pairs not taken from the file mean the snapshot no longer matches
+            # any dataset version; the next file change forces a full reload
+            self.dataset_version = dataset_version
+        if len(snapshot.delta) >= DELTA_MAX_ROWS:
+            self.compact_async()
+        return snapshot
+
+    def _extend(self, base, questions, answers, processed):
+        if base.delta:
+            delta = base.delta.extend(questions, answers, processed)
+        else:
+            projection = base.engine.projection if isinstance(base.engine, DenseEngine) else None
+            delta = DeltaSegment(questions, answers, processed, base.index, projection)
+        version = f"{base.base_version}+{len(delta)}"
+        return Snapshot(base.index, base.engine, version, delta, base.base_version, base.fallback)
+
+    # Refit the base index with the delta folded in, off the request path.
+    # When the delta came from the dataset file, the merged rows are exactly
+    # the file as it is now, so this is a reload: its artifact is built once
+    # for all workers and kept for the next start.
+    def compact(self):
+        with self._reload_lock:
+            base, dataset_version = self.current, self.dataset_version
+        if not base.delta:
+            return base
+        if dataset_version is not None:
+            return self.reload()
+        delta = base.delta
+        lemmas = dict(base.index.lemmas.items())
+        lemmas.update(build_lemma_table(delta.questions))
+        index = index_from_processed(
+            list(base.index.questions) + delta.questions, list(base.index.answers) + delta.answers,
+            list(base.index.processed) + delta.processed, lemmas, f"{base.index.version}+{len(delta)}")
+
+        with self._reload_lock:
+            current = self.current
+            if current.index is not base.index:
+                return current  # a full reload won the race
+            snapshot = self.make_snapshot(index)
+            # Carry over pairs that arrived while compacting
+            start = len(delta)
+            if len(current.delta) > start:
+                late = current.delta
+                snapshot = self._extend(snapshot, late.questions[start:], late.answers[start:],
+                                        late.processed[start:])
+            self.reloads += 1
+            return self._publish(snapshot)
+
+    def compact_async(self):
+        if self._compacting:
+            return
+        self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Index compaction failed: {e}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name='index-compaction', daemon=True).start()
+
+    # If the file only grew by whole rows, return (questions, answers, new hash)
+    # for the appended part; otherwise None
+    def _appended_rows(self):
+        if is_compiled_dataset(self.dataset_path):
+            return None  # compiled datasets are rewritten whole
+        old_size = self._dataset_size
+        with open(self.dataset_path, 'rb') as f:
+            prefix = f.read(old_size)
+            tail = f.read()
+        digest = hashlib.sha256(prefix)
+        if self.dataset_version is None or not tail or not prefix.endswith(b'\n') or digest.hexdigest() != self.dataset_version:
+            return None
+        digest.update(tail)
+        columns = pd.read_csv(io.BytesIO(prefix), nrows=0).columns
+        rows = clean_dataset(pd.read_csv(io.BytesIO(tail), header=None, names=columns))
+        self._dataset_size = old_size + len(tail)
+        return rows['Question'].tolist(), rows['Answer'].tolist(), digest.hexdigest()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            stat = self._dataset_stat()
+            if stat is None or stat == self._stat:
+                continue
+            # Wait for the file to stop changing before reading it
+            time.sleep(interval)
+            if self._dataset_stat() != stat:
+                continue
+            self._stat = stat
+            try:
+                appended = self._appended_rows()
+                if appended:
+                    questions, answers, version = appended
+                    self.add_pairs(questions, answers, dataset_version=version)
+                    print(f"Appended {len(questions)} rows, dataset version {version[:16]}")
+                else:
+                    snapshot = self.reload()
+                    print(f"Loaded dataset version {snapshot.index.version[:16]}")
+            except Exception as e:
+                print(f"Dataset reload failed, keeping current index: {e}")
+
+    # Start the background watcher; call once per process (after any fork)
+    def start_watcher(self, interval):
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                             name='dataset-watcher', daemon=True)
+            self._watcher.start()
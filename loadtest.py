@@ -0,0 +1,191 @@
+# Load generator for a running chatbot server.
+#
+#   python loadtest.py --target dash --concurrency 16 --duration 60
+#   python loadtest.py --target json --url http://localhost:8000 --log queries.txt
+#
+# Each worker thread keeps one HTTP connection open and sends requests back
+# to back, so --concurrency is the number of requests in flight.
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+# The callback that answers questions in chatbot.py, as the browser calls it
+DASH_PATH = '/_dash-update-component'
+DASH_OUTPUTS = [{'id': 'output-area', 'property': 'children'}, {'id': 'user-input', 'property': 'value'}]
+# The callback catches its own exceptions and answers 200 with this class
+DASH_ERROR_MARKER = b'error-message'
+
+
+def dash_request(question):
+    return DASH_PATH, {
+        'output': '..output-area.children...user-input.value..',
+        'outputs': DASH_OUTPUTS,
+        'inputs': [{'id': 'submit-button', 'property': 'n_clicks', 'value': 1}],
+        'changedPropIds': ['submit-button.n_clicks'],
+        'state': [{'id': 'user-input', 'property': 'value', 'value': question}],
+    }
+
+
+def json_request(question):
+    return '/api/answer', {'question': question}
+
+
+def batch_request(question):
+    return '/api/answer_batch', {'questions': [question]}
+
+
+TARGETS = {
+    'dash': dash_request,
+    'json': json_request,
+    'batch': batch_request,
+}
+
+
+# One question per line, or a CSV with a Question column
+def load_query_log(path):
+    if path.endswith('.csv'):
+        return pd.read_csv(path)['Question'].dropna().astype(str).tolist()
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# Zipf-distributed draws from the dataset questions: a few questions are
+# asked very often and most rarely, as in real FAQ traffic
+def zipf_queries(dataset, n, s=1.1, seed=0):
+    questions = pd.read_csv(dataset)['Question'].dropna().astype(str).tolist()
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, len(questions) + 1) ** s
+    order = rng.permutation(len(questions))
+    picks = rng.choice(len(questions), size=n, p=weights / weights.sum())
+    return [questions[order[i]] for i in picks]
+
+
+class LoadTest:
+    def __init__(self, url, target, queries, concurrency, duration, max_requests, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.target = target
+        self.make_request = TARGETS[target]
+        self.queries = queries
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.latencies = []
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _take(self):
+        with self._lock:
+            if self.max_requests and self._next >= self.max_requests:
+                return None
+            i = self._next
+            self._next += 1
+        return self.queries[i % len(self.queries)]
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _worker(self, deadline):
+        conn = self._connect()
+        latencies, outcomes = [], Counter()
+        while time.perf_counter() < deadline:
+            question = self._take()
+            if question is None:
+                break
+            path, payload = self.make_request(question)
+            body = json.dumps(payload)
+            start = time.perf_counter()
+            try:
+                conn.request('POST', path, body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                data = response.read()
+                outcome = str(response.status)
+                if outcome == '200' and self.target == 'dash' and DASH_ERROR_MARKER in data:
+                    outcome = 'dash-error'
+            except (OSError, http.client.HTTPException) as e:
+                outcome = type(e).__name__
+                conn.close()
+                conn = self._connect()
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] += 1
+        conn.close()
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.outcomes.update(outcomes)
+
+    def run(self):
+        start = time.perf_counter()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self._worker, args=(deadline,), daemon=True)
+                   for _ in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        total = sum(self.outcomes.values())
+        ok = self.outcomes.get('200', 0)
+        lat_ms = np.asarray(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'requests': total,
+            'elapsed_s': elapsed,
+            'throughput_rps': total / elapsed if elapsed else 0.0,
+            'error_rate': (total - ok) / total if total else 0.0,
+            'outcomes': dict(self.outcomes),
+            'latency_ms': {'p50': float(np.percentile(lat_ms, 50)), 'p90': float(np.percentile(lat_ms, 90)),
+                           'p99': float(np.percentile(lat_ms, 99)), 'max': float(lat_ms.max()),
+                           'mean': float(lat_ms.mean())},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running chatbot server")
+    parser.add_argument('--url', default='http://localhost:8050')
+    parser.add_argument('--target', choices=TARGETS, default='dash',
+                        help="dash: the UI callback, json: /api/answer (asgi.py), batch: /api/answer_batch")
+    parser.add_argument('--log', help="query log to replay (text, one per line, or CSV with a Question column)")
+    parser.add_argument('--dataset', default='chatbot_dataset.csv',
+                        help="questions to sample from when no log is given")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent for sampled questions")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--requests', type=int, default=0, help="stop after this many requests (0: no limit)")
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    queries = load_query_log(args.log) if args.log else zipf_queries(args.dataset, 100000, args.zipf, args.seed)
+    if not queries:
+        parser.error("no queries to send")
+    test = LoadTest(args.url, args.target, queries, args.concurrency, args.duration, args.requests, args.timeout)
+    report = test.run()
+    report.update({'url': args.url, 'target': args.target, 'concurrency': args.concurrency})
+
+    lat = report['latency_ms']
+    print(f"requests:    {report['requests']} in {report['elapsed_s']:.1f}s "
+          f"({report['throughput_rps']:.1f} req/s, concurrency {args.concurrency})")
+    print(f"latency ms:  p50 {lat['p50']:.1f}  p90 {lat['p90']:.1f}  p99 {lat['p99']:.1f}  max {lat['max']:.1f}")
+    print(f"errors:      {report['error_rate']:.2%} {report['outcomes']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report['requests'] == 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import contextlib
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Off by default; when off, span() hands back a shared no-op context manager
+METRICS_ENABLED = os.environ.get('CHATBOT_METRICS', '0') == '1'
+# Histogram bucket upper bounds in seconds, 50us to 10s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'chatbot_stage_seconds': "Time spent in each stage of answering a question",
+    'chatbot_request_seconds': "HTTP request latency by route, including Dash serialization",
+}
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+# Fixed-bucket histogram; observing is a bisect and two increments under a lock
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+# (metric, label name, label value) -> Histogram
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(metric, label, value):
+    key = (metric, label, value)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(key, Histogram())
+    return hist
+
+
+class Span:
+    __slots__ = ('hist', 'start')
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+# with span('search'): ... records the block's wall time for that stage
+def span(stage):
+    if not METRICS_ENABLED:
+        return NULL_SPAN
+    return Span(histogram('chatbot_stage_seconds', 'stage', stage))
+
+
+def observe_request(route, seconds):
+    histogram('chatbot_request_seconds', 'route', route).observe(seconds)
+
+
+# Prometheus text exposition format (version 0.0.4)
+def render():
+    lines = []
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    current = None
+    for (metric, label, value), hist in items:
+        if metric != current:
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+            current = metric
+        counts, total = hist.snapshot()
+        value = value.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="{le}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{value}"}} {total}')
+        lines.append(f'{metric}_count{{{label}="{value}"}} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,115 @@
+import argparse
+import os
+import threading
+
+import nltk
+
+# Vendored NLTK data shipped next to the app; searched before the NLTK defaults
+VENDORED_DATA_DIR = os.environ.get(
+    'CHATBOT_NLTK_DATA',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data'))
+
+# Resource name -> data paths that satisfy it, in order of preference.
+# NLTK >= 3.8.2 tokenizes with punkt_tab; older releases use the punkt pickle.
+RESOURCES = {
+    'punkt': ['tokenizers/punkt_tab/english/', 'tokenizers/punkt/english.pickle'],
+    'wordnet': ['corpora/wordnet', 'corpora/wordnet.zip'],
+}
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+class NLPResourceError(RuntimeError):
+    pass
+
+
+def _add_vendored_path():
+    if os.path.isdir(VENDORED_DATA_DIR) and VENDORED_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, VENDORED_DATA_DIR)
+
+
+# Locate a resource on disk only; never touches the network
+def find_resource(name):
+    _add_vendored_path()
+    for candidate in RESOURCES[name]:
+        try:
+            return nltk.data.find(candidate)
+        except LookupError:
+            continue
+    raise NLPResourceError(
+        f"NLTK resource '{name}' not found (looked for {', '.join(RESOURCES[name])} "
+        f"in {', '.join(map(str, nltk.data.path))}). Vendor it with "
+        f"'python nlp_resources.py download --dir {VENDORED_DATA_DIR}' on a machine "
+        f"with network access, or point CHATBOT_NLTK_DATA at an existing copy.")
+
+
+def _load_once(name, loader):
+    obj = _loaded.get(name)
+    if obj is not None:
+        return obj
+    with _lock:
+        if name not in _loaded:
+            find_resource(name)
+            try:
+                _loaded[name] = loader()
+            except LookupError as e:
+                raise NLPResourceError(f"NLTK resource '{name}' failed to load: {e}") from e
+        return _loaded[name]
+
+
+def _load_tokenizer():
+    from nltk.tokenize import word_tokenize
+    word_tokenize("warm up")
+    return word_tokenize
+
+
+def _load_lemmatizer():
+    from nltk.corpus import wordnet
+    from nltk.stem import WordNetLemmatizer
+    # Force the lazy corpus loader now so a broken install fails here
+    wordnet.ensure_loaded()
+    return WordNetLemmatizer()
+
+
+# word_tokenize, loaded on first use
+def get_tokenizer():
+    return _load_once('punkt', _load_tokenizer)
+
+
+# WordNetLemmatizer, loaded on first use
+def get_lemmatizer():
+    return _load_once('wordnet', _load_lemmatizer)
+
+
+# Eagerly verify everything is available, e.g. at the start of an index build
+def check_resources():
+    get_tokenizer()
+    get_lemmatizer()
+
+
+def download(target_dir):
+    os.makedirs(target_dir, exist_ok=True)
+    for package in ('punkt', 'punkt_tab', 'wordnet'):
+        if not nltk.download(package, download_dir=target_dir, quiet=True):
+            raise NLPResourceError(f"Failed to download NLTK package '{package}'")
+    print(f"NLTK data vendored into {target_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the chatbot's NLTK data")
+    sub = parser.add_subparsers(dest='command', required=True)
+    dl = sub.add_parser('download', help="vendor punkt and wordnet for offline use")
+    dl.add_argument('--dir', default=VENDORED_DATA_DIR)
+    sub.add_parser('check', help="verify the data loads without network access")
+    args = parser.parse_args()
+
+    if args.command == 'download':
+        download(args.dir)
+    else:
+        check_resources()
+        print("NLTK resources OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import functools
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from nlp_resources import NLPResourceError, get_lemmatizer, get_tokenizer
+
+# Bounded memo tables for repeated questions and repeated tokens
+PREPROCESS_CACHE_SIZE = int(os.environ.get('CHATBOT_PREPROCESS_CACHE', '10000'))
+LEMMA_CACHE_SIZE = int(os.environ.get('CHATBOT_LEMMA_CACHE', '50000'))
+# 'nltk' runs word_tokenize + WordNet per token, 'fast' uses one compiled
+# regex and a precomputed lemma table, falling back to WordNet only for
+# tokens the table has never seen
+PREPROCESSOR = os.environ.get('CHATBOT_PREPROCESSOR', 'nltk')
+# Process pool used to preprocess the corpus at index build time
+BUILD_WORKERS = int(os.environ.get('CHATBOT_BUILD_WORKERS', os.cpu_count() or 1))
+BUILD_CHUNK_SIZE = int(os.environ.get('CHATBOT_BUILD_CHUNK_SIZE', '2000'))
+
+# Single-pass approximation of NLTK's Treebank word tokenizer for lowercased
+# text: clitics and "n't" split off, hyphenated/dotted words kept whole, any
+# other punctuation character on its own
+TOKEN_RE = re.compile(r"""
+    \w+(?=n't\b)
+  | n't\b
+  | '(?:s|m|d|re|ve|ll)\b
+  | \w+(?:[-.]\w+|'(?!(?:s|m|d|re|ve|ll|t)\b)\w+)*
+  | \.\.\.
+  | [^\w\s]
+""", re.VERBOSE)
+
+# Treebank splits these even without an apostrophe
+TOKEN_SPLITS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+# token -> lemma, set from the index artifact or build_lemma_table()
+_lemma_table = {}
+
+
+@functools.lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(token):
+    return get_lemmatizer().lemmatize(token)
+
+
+def fast_tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        if token == '"':
+            # Treebank turns straight quotes into opening/closing quote tokens
+            start = match.start()
+            token = '``' if start == 0 or text[start - 1] in ' ([{<' else "''"
+        if token in TOKEN_SPLITS:
+            tokens.extend(TOKEN_SPLITS[token])
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def nltk_preprocess(text):
+    tokens = get_tokenizer()(text)
+    return ' '.join(lemmatize(token) for token in tokens)
+
+
+def fast_preprocess(text):
+    table = _lemma_table
+    return ' '.join(table.get(token) or lemmatize(token) for token in fast_tokenize(text))
+
+
+PREPROCESSORS = {
+    'nltk': nltk_preprocess,
+    'fast': fast_preprocess,
+}
+if PREPROCESSOR not in PREPROCESSORS:
+    raise ValueError(f"Unknown preprocessor '{PREPROCESSOR}', expected one of {', '.join(PREPROCESSORS)}")
+
+
+# Precompute lemmas for every token the fast tokenizer produces on the corpus
+def build_lemma_table(texts):
+    tokens = set()
+    for text in texts:
+        tokens.update(fast_tokenize(str(text).lower().strip()))
+    return {token: lemmatize(token) for token in tokens}
+
+
+# Accepts a dict or the index's memory-mapped StringMap; only .get() is used
+def set_lemma_table(table):
+    global _lemma_table
+    _lemma_table = table
+
+
+# Keyed on the normalized text so "Hi" and " hi " share one entry
+@functools.lru_cache(maxsize=PREPROCESS_CACHE_SIZE)
+def _preprocess_normalized(text):
+    return PREPROCESSORS[PREPROCESSOR](text)
+
+
+# Preprocessing function with error handling
+def preprocess_text(text):
+    try:
+        if pd.isna(text):
+            return ""
+        return _preprocess_normalized(str(text).lower().strip())
+    except NLPResourceError:
+        # Missing NLTK data is a deployment problem, not a bad question
+        raise
+    except:
+        return ""
+
+# Preprocess a sequence of texts, preserving order
+def preprocess_batch(texts):
+    return [preprocess_text(text) for text in texts]
+
+
+def _preprocess_chunk(texts):
+    return preprocess_batch(texts), build_lemma_table(texts)
+
+
+# Preprocess a stream of (payload, texts) chunks, yielding
+# (payload, processed, lemmas) in input order. Chunks are fanned out to a
+# process pool with at most two per worker in flight, so memory stays bounded
+# by the chunk size however long the stream is.
+def preprocess_stream(chunks, workers=BUILD_WORKERS):
+    if workers <= 1:
+        for payload, texts in chunks:
+            yield (payload, *_preprocess_chunk(texts))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for payload, texts in chunks:
+            pending.append((payload, pool.submit(_preprocess_chunk, list(texts))))
+            if len(pending) >= 2 * workers:
+                payload, future = pending.popleft()
+                yield (payload, *future.result())
+        while pending:
+            payload, future = pending.popleft()
+            yield (payload, *future.result())
+
+
+# Preprocess corpus questions and collect their lemma table, in dataset order
+def preprocess_corpus(texts, workers=BUILD_WORKERS, chunksize=BUILD_CHUNK_SIZE):
+    texts = list(texts)
+    if workers <= 1 or len(texts) <= chunksize:
+        return _preprocess_chunk(texts)
+
+    chunks = ((None, texts[i:i + chunksize]) for i in range(0, len(texts), chunksize))
+    processed, lemmas = [], {}
+    for _, chunk_processed, chunk_lemmas in preprocess_stream(chunks, workers):
+        processed.extend(chunk_processed)
+        lemmas.update(chunk_lemmas)
+    return processed, lemmas
+
+
+# Hit/miss counters for both memo tables
+def cache_stats():
+    return {
+        'preprocess': _preprocess_normalized.cache_info()._asdict(),
+        'lemma': lemmatize.cache_info()._asdict(),
+    }
+
+
+def clear_caches():
+    _preprocess_normalized.cache_clear()
+    lemmatize.cache_clear()
@@ -0,0 +1,102 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# Where collapsed stack files are written, and how often stacks are sampled
+PROFILE_DIR = os.environ.get('CHATBOT_PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.environ.get('CHATBOT_PROFILE_INTERVAL', '0.005'))
+# Longest window the admin endpoint accepts, in seconds
+PROFILE_MAX_SECONDS = float(os.environ.get('CHATBOT_PROFILE_MAX_SECONDS', '300'))
+
+
+def frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+# Statistical profiler for a live process: a daemon thread wakes every
+# `interval` seconds, walks the stack of every other thread and counts each
+# distinct stack. The result is written in collapsed format ("root;...;leaf
+# count" per line), which flamegraph.pl, speedscope and inferno read directly.
+# Nothing is hooked into the code being profiled, so overhead is limited to
+# the sampler thread briefly holding the GIL.
+class SamplingProfiler:
+    def __init__(self, seconds, interval=PROFILE_INTERVAL, output_dir=PROFILE_DIR):
+        self.seconds = seconds
+        self.interval = interval
+        self.output_dir = output_dir
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.output = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self):
+        deadline = self.started + self.seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            self.sample()
+            self._stop.wait(self.interval)
+        self.output = self.write()
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.output_dir, f"profile-{os.getpid()}-{stamp}.collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Wrote {self.samples} profile samples to {path}")
+        return path
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.output
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {'running': self.running(), 'seconds': self.seconds, 'interval': self.interval,
+                'samples': self.samples, 'output': self.output}
+
+
+# At most one profile per process at a time
+_current = None
+_lock = threading.Lock()
+
+
+def start_profile(seconds, interval=PROFILE_INTERVAL):
+    global _current
+    with _lock:
+        if _current is not None and _current.running():
+            raise RuntimeError("A profile is already running in this process")
+        _current = SamplingProfiler(seconds, interval).start()
+        return _current
+
+
+def current_profile():
+    return _current
@@ -0,0 +1,129 @@
+import numpy as np
+from scipy import sparse
+
+from dense_index import DenseEngine, HNSWIndex, IVFIndex, LSAIndex
+
+
+# Exact top-k cosine search over an L2-normalized TF-IDF matrix.
+# Rows of TfidfVectorizer output are unit length, so cosine similarity is a
+# plain sparse dot product and only documents sharing a term with the query
+# ever get touched.
+class CosineTopK:
+    def __init__(self, X, XT=None):
+        self.X = sparse.csr_matrix(X)
+        self.n_docs = self.X.shape[0]
+        # Term -> documents layout so a query only walks its own postings;
+        # pass the precomputed one from the index to share it across workers
+        self.XT = sparse.csr_matrix(XT) if XT is not None else self.X.T.tocsr()
+
+    # Returns (scores, indices), both shaped (n_queries, k), best first.
+    # Empty query rows (no in-vocabulary terms) are never scored: they come
+    # back with score 0 and index -1.
+    def search(self, Q, k=1):
+        Q = sparse.csr_matrix(Q)
+        k = min(k, self.n_docs)
+        scores = np.zeros((Q.shape[0], k), dtype=np.float64)
+        indices = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        active = np.flatnonzero(np.diff(Q.indptr))
+        if not len(active):
+            return scores, indices
+        S = (Q[active] @ self.XT).tocsr()
+        for n, row in enumerate(active):
+            start, end = S.indptr[n], S.indptr[n + 1]
+            scores[row], indices[row] = self._top_k(S.indices[start:end], S.data[start:end], k)
+        return scores, indices
+
+    def _top_k(self, cand, cand_scores, k):
+        if len(cand) > k:
+            part = np.argpartition(-cand_scores, k - 1)[:k]
+            cand, cand_scores = cand[part], cand_scores[part]
+        order = np.lexsort((cand, -cand_scores))
+        cand, cand_scores = cand[order], cand_scores[order]
+        if len(cand) < k:
+            # Not enough overlapping documents: pad with zero-score rows
+            filler = np.setdiff1d(np.arange(min(self.n_docs, k + len(cand))), cand)[:k - len(cand)]
+            cand = np.concatenate([cand, filler])
+            cand_scores = np.concatenate([cand_scores, np.zeros(len(filler))])
+        return cand_scores, cand
+
+
+# Term-at-a-time inverted index with MaxScore-style early termination.
+# Query terms are visited in decreasing order of their best possible
+# contribution; once the current k-th best score beats what the remaining
+# terms could add to an unseen document, no new candidates are admitted and
+# the rest of the postings are only probed for the surviving candidates.
+class InvertedIndex(CosineTopK):
+    def __init__(self, X, XT=None):
+        super().__init__(X, XT)
+        postings = self.XT
+        self.max_weight = np.zeros(postings.shape[0])
+        nonempty = np.diff(postings.indptr) > 0
+        self.max_weight[nonempty] = np.maximum.reduceat(postings.data, postings.indptr[:-1][nonempty])
+
+    def search(self, Q, k=1):
+        Q = sparse.csr_matrix(Q)
+        k = min(k, self.n_docs)
+        scores = np.zeros((Q.shape[0], k), dtype=np.float64)
+        indices = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        for row in np.flatnonzero(np.diff(Q.indptr)):
+            start, end = Q.indptr[row], Q.indptr[row + 1]
+            cand, cand_scores = self._score(Q.indices[start:end], Q.data[start:end], k)
+            scores[row], indices[row] = self._top_k(cand, cand_scores, k)
+        return scores, indices
+
+    def _score(self, terms, weights, k):
+        postings = self.XT
+        bounds = weights * self.max_weight[terms]
+        remaining = bounds.sum()
+        cand = np.zeros(0, dtype=np.int64)
+        cand_scores = np.zeros(0)
+        admitting = True
+
+        for j in np.argsort(-bounds):
+            start, end = postings.indptr[terms[j]], postings.indptr[terms[j] + 1]
+            docs = postings.indices[start:end]
+            contrib = weights[j] * postings.data[start:end]
+            remaining = max(remaining - bounds[j], 0.0)
+
+            if admitting:
+                cand, inverse = np.unique(np.concatenate([cand, docs]), return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=np.concatenate([cand_scores, contrib]),
+                                          minlength=len(cand))
+            elif len(docs):
+                # Postings are sorted by document, so probe them by binary search
+                pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+                hit = docs[pos] == cand
+                cand_scores[hit] += contrib[pos[hit]]
+
+            if len(cand) >= k:
+                threshold = np.partition(cand_scores, len(cand) - k)[len(cand) - k]
+                if threshold >= remaining:
+                    admitting = False
+                if not admitting:
+                    keep = cand_scores + remaining >= threshold
+                    cand, cand_scores = cand[keep], cand_scores[keep]
+        return cand, cand_scores
+
+
+# Every engine takes (X, XT) at construction and answers search(Q, k) with
+# (scores, indices) best first; dense ones embed X with LSA first, or take a
+# prebuilt LSAProjection
+ENGINES = {
+    'cosine': CosineTopK,
+    'inverted': InvertedIndex,
+    'lsa': LSAIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+}
+
+
+def is_dense(name):
+    return issubclass(ENGINES[name], DenseEngine)
+
+
+def build_engine(name, X, XT=None, projection=None):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown retrieval mode '{name}', expected one of {', '.join(ENGINES)}")
+    if is_dense(name):
+        return ENGINES[name](X, XT, projection)
+    return ENGINES[name](X, XT)